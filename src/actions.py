@@ -1,11 +1,12 @@
 # Copyright (C) 2020-2022 viraelin
 # License: GPLv3.0
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import (Qt, QLocale)
 from PyQt6.QtWidgets import (QMenu, QWidgetAction)
 from PyQt6.QtGui import (QAction, QKeySequence)
 
 import system
+import commands
 
 
 class Actions:
@@ -13,6 +14,8 @@ class Actions:
     def __init__(self, parent) -> None:
         self.parent = parent
         self.menu = QMenu(parent)
+        self.menu.setToolTipsVisible(True)
+        self.menu.aboutToShow.connect(self.onMenuAboutToShow)
 
         self.undo = QAction(parent)
         self.undo.triggered.connect(self.onUndo)
@@ -35,6 +38,13 @@ class Actions:
         self.save.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
         self.parent.addAction(self.save)
 
+        self.save_as = QAction(parent)
+        self.save_as.triggered.connect(self.onSaveAs)
+        self.save_as.setText("Save As")
+        self.save_as.setShortcut(QKeySequence.StandardKey.SaveAs)
+        self.save_as.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+        self.parent.addAction(self.save_as)
+
         self.open = QAction(parent)
         self.open.triggered.connect(self.onOpen)
         self.open.setText("Open")
@@ -71,6 +81,20 @@ class Actions:
         self.select_all.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
         self.parent.addAction(self.select_all)
 
+        self.invert_selection = QAction(parent)
+        self.invert_selection.triggered.connect(self.onInvertSelection)
+        self.invert_selection.setText("Invert Selection")
+        self.invert_selection.setShortcut(QKeySequence("CTRL+I"))
+        self.invert_selection.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+        self.parent.addAction(self.invert_selection)
+
+        self.clear_selection = QAction(parent)
+        self.clear_selection.triggered.connect(self.onClearSelection)
+        self.clear_selection.setText("Select None")
+        self.clear_selection.setShortcut(QKeySequence("CTRL+SHIFT+A"))
+        self.clear_selection.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+        self.parent.addAction(self.clear_selection)
+
         self.filtering = QWidgetAction(parent)
         self.filtering.setCheckable(True)
         self.filtering.toggled.connect(self.onFiltering)
@@ -103,11 +127,36 @@ class Actions:
         self.import_images.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
         self.parent.addAction(self.import_images)
 
+        self.paste = QAction(parent)
+        self.paste.triggered.connect(self.onPaste)
+        self.paste.setText("Paste")
+        self.paste.setShortcut(QKeySequence.StandardKey.Paste)
+        self.paste.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+        self.parent.addAction(self.paste)
+
+        self.import_folder = QAction(parent)
+        self.import_folder.triggered.connect(self.onImportFolder)
+        self.import_folder.setText("Import Folder")
+        self.parent.addAction(self.import_folder)
+
+        self.cancel_import = QAction(parent)
+        self.cancel_import.triggered.connect(self.onCancelImport)
+        self.cancel_import.setText("Cancel Import")
+        self.cancel_import.setShortcut(QKeySequence(Qt.Key.Key_Escape))
+        self.cancel_import.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+        self.cancel_import.setEnabled(False)
+        self.parent.addAction(self.cancel_import)
+
         self.export_images = QAction(parent)
         self.export_images.triggered.connect(self.onExportImages)
         self.export_images.setText("Export")
         self.parent.addAction(self.export_images)
         
+        self.compact = QAction(parent)
+        self.compact.triggered.connect(self.onCompact)
+        self.compact.setText("Compact Project")
+        self.parent.addAction(self.compact)
+
         self.new = QAction(parent)
         self.new.triggered.connect(self.onNew)
         self.new.setText("New")
@@ -119,6 +168,9 @@ class Actions:
         self.menu.addAction(self.redo)
         self.menu.addSeparator()
         self.menu.addAction(self.select_all)
+        self.menu.addAction(self.invert_selection)
+        self.menu.addAction(self.clear_selection)
+        self.menu.addAction(self.paste)
         self.menu.addAction(self.grayscale)
         self.menu.addAction(self.filtering)
         self.menu.addSeparator()
@@ -132,8 +184,12 @@ class Actions:
         self.menu.addAction(self.new)
         self.menu.addAction(self.open)
         self.menu.addAction(self.import_images)
+        self.menu.addAction(self.import_folder)
+        self.menu.addAction(self.cancel_import)
         self.menu.addSeparator()
         self.menu.addAction(self.save)
+        self.menu.addAction(self.save_as)
+        self.menu.addAction(self.compact)
         self.menu.addSeparator()
         self.menu.addAction(self.quit)
 
@@ -152,6 +208,10 @@ class Actions:
         self.parent.save()
 
 
+    def onSaveAs(self) -> None:
+        self.parent.saveAs()
+
+
     def onOpen(self) -> None:
         self.parent.open()
 
@@ -172,6 +232,14 @@ class Actions:
         self.parent.selectAll()
 
 
+    def onInvertSelection(self) -> None:
+        self.parent.invertSelection()
+
+
+    def onClearSelection(self) -> None:
+        self.parent.clearSelection()
+
+
     def onFiltering(self, state: bool) -> None:
         self.parent.setFiltering(state)
 
@@ -184,6 +252,12 @@ class Actions:
         self.parent.deleteSelection()
 
 
+    def onMenuAboutToShow(self) -> None:
+        # the undo history is only measured when the menu is opened
+        size = QLocale().formattedDataSize(commands.getMemory(system.undo_stack))
+        self.undo.setToolTip(f"Undo history: {system.undo_stack.count()} steps, {size}")
+
+
     def onUndo(self) -> None:
         system.undo_stack.undo()
 
@@ -200,9 +274,25 @@ class Actions:
         self.parent.importImages()
 
 
+    def onPaste(self) -> None:
+        self.parent.paste()
+
+
+    def onImportFolder(self) -> None:
+        self.parent.importFolder()
+
+
+    def onCancelImport(self) -> None:
+        self.parent.cancelImport()
+
+
     def onExportImages(self) -> None:
         self.parent.exportImages()
 
 
     def onNew(self) -> None:
         self.parent.new()
+
+
+    def onCompact(self) -> None:
+        self.parent.compactProject()
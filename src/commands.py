@@ -1,6 +1,10 @@
 # Copyright (C) 2020-2022 viraelin
 # License: GPLv3.0
 
+import sys
+import time
+from array import array
+
 from PyQt6.QtCore import *
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
@@ -9,27 +13,198 @@ import system
 from graphics_item import GraphicsItem
 
 
+# merged commands of the same kind on the same items
+MOVE_ID = 1
+TRANSFORM_ID = 2
+# values per item in transform states: x, y, rotation in degrees, scale
+STATE_SIZE = 4
+
+
+def getMemory(stack: QUndoStack) -> int:
+    return sum(stack.command(i).getSize() for i in range(stack.count()))
+
+
 class Move(QUndoCommand):
 
     def __init__(self, items: list[GraphicsItem], offset: QPointF, skip=False, parent=None) -> None:
         super().__init__(parent=parent)
-        self.items = items
-        self.offset = offset
+        self.setText("Move")
+        self.item_ids = array("q", (item.id for item in items))
+        self.dx = offset.x()
+        self.dy = offset.y()
         self.skip = skip
+        self.time = time.monotonic()
+
+
+    def id(self) -> int:
+        return MOVE_ID
+
+
+    def mergeWith(self, other: QUndoCommand) -> bool:
+        if other.time - self.time > system.UNDO_MERGE_INTERVAL or other.item_ids != self.item_ids:
+            return False
+        self.dx += other.dx
+        self.dy += other.dy
+        self.time = other.time
+        return True
+
+
+    def getSize(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.item_ids)
 
 
     def undo(self) -> None:
-        x = self.offset.x()
-        y = self.offset.y()
-        for item in self.items:
-            item.moveBy(-x, -y)
+        for item_id in self.item_ids:
+            item = system.item_registry.get(item_id)
+            if item:
+                item.moveBy(-self.dx, -self.dy)
 
 
     def redo(self) -> None:
         if self.skip:
             self.skip = False
             return
-        x = self.offset.x()
-        y = self.offset.y()
-        for item in self.items:
-            item.moveBy(x, y)
+        for item_id in self.item_ids:
+            item = system.item_registry.get(item_id)
+            if item:
+                item.moveBy(self.dx, self.dy)
+
+
+class Transform(QUndoCommand):
+
+    def __init__(self, text: str, items: list[GraphicsItem], before: array, parent=None) -> None:
+        super().__init__(parent=parent)
+        # already applied when pushed, before is captured by the caller
+        self.setText(text)
+        self.item_ids = array("q", (item.id for item in items))
+        self.before = before
+        self.after = Transform.capture(items)
+        self.skip = True
+        self.time = time.monotonic()
+
+
+    @staticmethod
+    def capture(items: list[GraphicsItem]) -> array:
+        states = array("d")
+        for item in items:
+            item.normalizeTransform()
+            pos = item.pos()
+            states.extend((pos.x(), pos.y(), item.rotation(), item.scale()))
+        return states
+
+
+    def isChanged(self) -> bool:
+        return self.before != self.after
+
+
+    def id(self) -> int:
+        return TRANSFORM_ID
+
+
+    def mergeWith(self, other: QUndoCommand) -> bool:
+        if other.time - self.time > system.UNDO_MERGE_INTERVAL or other.item_ids != self.item_ids:
+            return False
+        if other.text() != self.text():
+            return False
+        self.after = other.after
+        self.time = other.time
+        return True
+
+
+    def getSize(self) -> int:
+        return (sys.getsizeof(self) + sys.getsizeof(self.item_ids)
+            + sys.getsizeof(self.before) + sys.getsizeof(self.after))
+
+
+    def apply(self, states: array) -> None:
+        for i, item_id in enumerate(self.item_ids):
+            item = system.item_registry.get(item_id)
+            if item is None:
+                continue
+            x, y, rotation, scale = states[i * STATE_SIZE:(i + 1) * STATE_SIZE]
+            item.setPos(x, y)
+            item.setRotation(rotation)
+            item.setScale(scale)
+
+
+    def undo(self) -> None:
+        self.apply(self.before)
+
+
+    def redo(self) -> None:
+        if self.skip:
+            self.skip = False
+            return
+        self.apply(self.after)
+
+
+class Flip(QUndoCommand):
+
+    def __init__(self, items: list[GraphicsItem], parent=None) -> None:
+        super().__init__(parent=parent)
+        self.setText("Flip")
+        self.item_ids = array("q", (item.id for item in items))
+
+
+    def getSize(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.item_ids)
+
+
+    def flip(self) -> None:
+        for item_id in self.item_ids:
+            item = system.item_registry.get(item_id)
+            if item:
+                item.flip()
+
+
+    def undo(self) -> None:
+        self.flip()
+
+
+    def redo(self) -> None:
+        self.flip()
+
+
+class Delete(QUndoCommand):
+
+    def __init__(self, scene: QGraphicsScene, items: list[GraphicsItem], parent=None) -> None:
+        super().__init__(parent=parent)
+        self.setText("Delete")
+        self.scene = scene
+        # the registry keeps deleted items until a save purges them
+        self.item_ids = array("q", (item.id for item in items))
+
+
+    def getSize(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.item_ids)
+
+
+    def undo(self) -> None:
+        items = system.item_registry.restore(self.item_ids)
+        if not items:
+            # purged by a save meanwhile
+            self.setObsolete(True)
+            return
+
+        for item in items:
+            self.scene.addItem(item)
+            system.pixmap_cache.add(item)
+        # pixmaps unloaded on delete are decoded again once visible
+        for view in self.scene.views():
+            view.cache_timer.start()
+
+
+    def redo(self) -> None:
+        items = [system.item_registry.get(item_id) for item_id in self.item_ids]
+        items = [item for item in items if item]
+        system.item_registry.bury(items)
+
+        # one selectionChanged for the whole batch
+        blocked = self.scene.blockSignals(True)
+        for item in items:
+            item.setSelected(False)
+            system.pixmap_cache.remove(item)
+            item.unloadPixmap()
+            self.scene.removeItem(item)
+        self.scene.blockSignals(blocked)
+        self.scene.selectionChanged.emit()
@@ -3,43 +3,171 @@
 
 import os
 import sqlite3
+import threading
 import math
+import hashlib
 
-import tempfile
 import rpack
-import shutil
-import urllib.request
 import time
+import functools
+import itertools
+import queue
+import http.client
+from typing import Iterator
 
 from PyQt6.QtCore import *
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 
 import system
+import ingest
+import network
 from graphics_view import GraphicsView
 from graphics_item import GraphicsItem
+from tiled_graphics_item import TiledGraphicsItem
 
 
 class Database:
 
     def __init__(self) -> None:
         self.file_path = ""
+        self.rows_written = 0
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+
+    def connection(self) -> sqlite3.Connection:
+        # one connection per thread, reopened when the project file changes
+        local = self._local
+        connection = getattr(local, "connection", None)
+        if connection and local.file_path == self.file_path:
+            return connection
+
+        if self.file_path == "":
+            connection = sqlite3.connect(system.MEMORY_DATABASE, uri=True,
+                check_same_thread=False, cached_statements=64)
+        else:
+            connection = sqlite3.connect(self.file_path, check_same_thread=False, cached_statements=64)
+        connection.row_factory = sqlite3.Row
+        # only applies to new files, existing ones are migrated by compact()
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        local.connection = connection
+        local.file_path = self.file_path
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+
+    def release(self) -> None:
+        # worker threads are new on every start, drop their connection when done
+        connection = getattr(self._local, "connection", None)
+        if not connection:
+            return
+
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        connection.close()
+        self._local.connection = None
+
+
+    def close(self) -> None:
+        # closing the last connection checkpoints and removes the WAL file
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
 
 
     def createDatabase(self) -> None:
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
-        cursor.execute("""CREATE TABLE IF NOT EXISTS
-        view(
-            id INTEGER PRIMARY KEY,
-            x INTEGER,
-            y INTEGER,
-            scale REAL
-            )""")
-        cursor.execute("INSERT OR IGNORE INTO view VALUES (?, ?, ?, ?)",
-            [0, 0, 0, 1.0])
-        cursor.execute("""CREATE TABLE IF NOT EXISTS
-        images(
+        connection = self.connection()
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS
+            view(
+                id INTEGER PRIMARY KEY,
+                x INTEGER,
+                y INTEGER,
+                scale REAL
+                )""")
+            connection.execute("INSERT OR IGNORE INTO view VALUES (?, ?, ?, ?)",
+                [0, 0, 0, 1.0])
+            self.createImagesTable(connection, "images")
+            # image data by content hash, shared by every item showing it
+            connection.execute("""CREATE TABLE IF NOT EXISTS
+            blobs(
+                hash TEXT PRIMARY KEY,
+                refs INTEGER,
+                image BLOB,
+                width INTEGER,
+                height INTEGER
+                )""")
+
+        self.migrateBlobs()
+
+        with connection:
+            # downscaled copies of blobs, level n is 1/2^n of the full size
+            # level 0 has no data and marks blobs that have been processed
+            connection.execute("""CREATE TABLE IF NOT EXISTS
+            mipmaps(
+                hash TEXT,
+                level INTEGER,
+                image BLOB,
+                PRIMARY KEY (hash, level)
+                )""")
+            # transforms changed since the last save, appended by autosave
+            # and replayed over images when the project was not saved
+            connection.execute("""CREATE TABLE IF NOT EXISTS
+            journal(
+                seq INTEGER PRIMARY KEY,
+                generation INTEGER,
+                id INTEGER,
+                x INTEGER,
+                y INTEGER,
+                z INTEGER,
+                rotation REAL,
+                scale REAL,
+                flip BOOL
+                )""")
+
+
+    def migrateBlobs(self) -> None:
+        # projects from before blobs keep the image data in the images table
+        connection = self.connection()
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(images)")]
+        if "blob" in columns:
+            return
+
+        start_time = time.perf_counter()
+        count = 0
+        with connection:
+            # one transaction, a half migrated project would look migrated;
+            # the table is rebuilt, DROP COLUMN needs SQLite 3.35
+            connection.execute("BEGIN")
+            self.createImagesTable(connection, "images_migrated")
+            # rows are read one at a time, only one image is in memory
+            for row in connection.execute("SELECT * FROM images ORDER BY id"):
+                digest = hashlib.sha256(row["image"]).hexdigest()
+                self.addBlob(digest, row["image"])
+                connection.execute("INSERT INTO images_migrated VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [row["id"], row["path"], row["type"], row["ctime"], row["mtime"], row["x"], row["y"],
+                    row["z"], row["rotation"], row["scale"], row["flip"], digest])
+                count += 1
+            connection.execute("DROP TABLE images")
+            connection.execute("ALTER TABLE images_migrated RENAME TO images")
+            # mipmaps were stored per item, they are generated again per blob
+            connection.execute("DROP TABLE IF EXISTS mipmaps")
+
+        elapsed = time.perf_counter() - start_time
+        print(f"migrated {count} images to blobs in {elapsed:.2f}s")
+
+
+    def createImagesTable(self, connection: sqlite3.Connection, name: str) -> None:
+        connection.execute(f"""CREATE TABLE IF NOT EXISTS
+        {name}(
             id INTEGER PRIMARY KEY,
             path TEXT,
             type TEXT,
@@ -51,178 +179,770 @@ class Database:
             rotation REAL,
             scale REAL,
             flip BOOL,
-            image BLOB
+            blob TEXT
             )""")
-        connection.commit()
 
 
-    def loadView(self) -> dict:
-        connection = sqlite3.connect(self.file_path)
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM view WHERE id == 0")
-        data = cursor.fetchall()[0]
-        return data
+    def getNextImageID(self) -> int:
+        cursor = self.connection().execute("SELECT COALESCE(MAX(id) + 1, 0) FROM images")
+        return cursor.fetchone()[0]
 
 
-    def loadImages(self) -> list[dict]:
-        connection = sqlite3.connect(self.file_path)
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM images")
-        data = cursor.fetchall()
+    def loadView(self) -> dict:
+        cursor = self.connection().execute("SELECT * FROM view WHERE id == 0")
+        data = cursor.fetchone()
         return data
 
 
-    def updateView(self, view: QGraphicsView) -> None:
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
-
+    @staticmethod
+    def getVisibleCondition(rect: QRectF) -> tuple[str, dict]:
+        # images whose extent touches rect; a rotated image is tested with the
+        # square around its origin that holds it at any angle
+        condition = """(CASE WHEN images.rotation == 0.0
+            THEN images.x <= :right AND images.x + blobs.width * images.scale >= :left
+                AND images.y <= :bottom AND images.y + blobs.height * images.scale >= :top
+            ELSE images.x - (blobs.width + blobs.height) * images.scale <= :right
+                AND images.x + (blobs.width + blobs.height) * images.scale >= :left
+                AND images.y - (blobs.width + blobs.height) * images.scale <= :bottom
+                AND images.y + (blobs.width + blobs.height) * images.scale >= :top
+            END)"""
+        params = {"left": rect.left(), "top": rect.top(), "right": rect.right(), "bottom": rect.bottom()}
+        return condition, params
+
+
+    def countImages(self, rect: QRectF = QRectF()) -> int:
+        if rect.isNull():
+            cursor = self.connection().execute("SELECT COUNT(*) FROM images")
+        else:
+            condition, params = Database.getVisibleCondition(rect)
+            cursor = self.connection().execute(f"""SELECT COUNT(*) FROM images
+                JOIN blobs ON blobs.hash == images.blob
+                WHERE {condition}""", params)
+        return cursor.fetchone()[0]
+
+
+    def loadImages(self, rect: QRectF = QRectF()) -> Iterator[sqlite3.Row]:
+        # metadata only, image data is fetched per item with getImage
+        # items inside rect come first, the rest ordered by distance from its center
+        condition, params = Database.getVisibleCondition(rect)
+        params["cx"] = rect.center().x()
+        params["cy"] = rect.center().y()
+        cursor = self.connection().execute(f"""SELECT
+            id, path, type, ctime, mtime, x, y, z, rotation, scale, flip, images.blob AS hash,
+            {condition} AS visible
+            FROM images
+            JOIN blobs ON blobs.hash == images.blob
+            ORDER BY visible DESC, (x - :cx) * (x - :cx) + (y - :cy) * (y - :cy)""", params)
+        for row in cursor:
+            yield row
+
+
+    @staticmethod
+    def getViewState(view: QGraphicsView) -> list:
         view_scale = view.transform().m11()
         view_pos = view.mapToScene(view.rect().center())
-        view_x = int(view_pos.x())
-        view_y = int(view_pos.y())
-        cursor.execute("UPDATE view SET x = ? WHERE id == 0", [view_x])
-        cursor.execute("UPDATE view SET y = ? WHERE id == 0", [view_y])
-        cursor.execute("UPDATE view SET scale = ? WHERE id == 0", [view_scale])
+        return [int(view_pos.x()), int(view_pos.y()), view_scale]
+
+
+    def updateView(self, view: QGraphicsView) -> None:
+        connection = self.connection()
+        with connection:
+            self.writeView(connection, Database.getViewState(view))
 
-        connection.commit()
 
+    def writeView(self, connection: sqlite3.Connection, state: list) -> None:
+        connection.execute("UPDATE view SET x = ?, y = ?, scale = ? WHERE id == 0", state)
 
-    def updateItems(self, items: list[GraphicsItem]) -> None:
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
 
+    @staticmethod
+    def getItemUpdates(items: list[GraphicsItem]) -> dict[tuple, list]:
+        # only dirty items and columns are written, grouped by changed columns
+        # taken on the GUI thread, edits made afterwards mark the items dirty again
+        updates: dict[tuple, list] = {}
         for item in items:
-            x = int(item.pos().x())
-            y = int(item.pos().y())
-            z = item.zValue()
-            scale = item.scale()
-            flip = item.is_flipped
-            rotation = item.getRotation()
-
-            cursor.execute("UPDATE images SET path = ? where id == ?", [item.path, item.id])
-            cursor.execute("UPDATE images SET type = ? where id == ?", [item.type, item.id])
-            cursor.execute("UPDATE images SET ctime = ? where id == ?", [item.ctime, item.id])
-            cursor.execute("UPDATE images SET mtime = ? where id == ?", [item.mtime, item.id])
-
-            cursor.execute("UPDATE images SET x = ? WHERE id == ?", [x, item.id])
-            cursor.execute("UPDATE images SET y = ? WHERE id == ?", [y, item.id])
-            cursor.execute("UPDATE images SET z = ? WHERE id == ?", [z, item.id])
-            cursor.execute("UPDATE images SET rotation = ? WHERE id == ?", [rotation, item.id])
-            cursor.execute("UPDATE images SET scale = ? WHERE id == ?", [scale, item.id])
-            cursor.execute("UPDATE images SET flip = ? WHERE id == ?", [flip, item.id])
-
-        connection.commit()
-        cursor.execute("VACUUM")
-
-
-    def storeItem(self, item: GraphicsItem) -> None:
-        if self.file_path == "":
+            if not item.dirty:
+                continue
+            state = item.getState()
+            columns = tuple(column for column in state if column in item.dirty)
+            row = [state[column] for column in columns]
+            row.append(item.id)
+            updates.setdefault(columns, []).append(row)
+            item.dirty.clear()
+        return updates
+
+
+    def writeSnapshot(self, snapshot: dict, connection: sqlite3.Connection = None) -> int:
+        # one transaction, rolled back as a whole when it fails
+        # journal entries up to generation are older than the snapshot
+        updates = snapshot.get("updates", {})
+        connection = connection or self.connection()
+        with connection:
+            if snapshot.get("view") is not None:
+                self.writeView(connection, snapshot["view"])
+            for columns, rows in updates.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                connection.executemany(f"UPDATE images SET {assignments} WHERE id == ?", rows)
+            if snapshot.get("generation") is not None:
+                connection.execute("DELETE FROM journal WHERE generation <= ?", [snapshot["generation"]])
+            self.deleteItems(connection, snapshot.get("deleted"))
+
+        self.rows_written = sum(len(rows) for rows in updates.values())
+        return self.rows_written
+
+
+    def writeJournal(self, generation: int, rows: list[list]) -> int:
+        connection = self.connection()
+        with connection:
+            connection.executemany("""INSERT INTO journal
+                (generation, id, x, y, z, rotation, scale, flip)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", [[generation] + row for row in rows])
+        return len(rows)
+
+
+    def countJournal(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+
+    def replayJournal(self) -> int:
+        # later entries of an item overwrite earlier ones
+        connection = self.connection()
+        with connection:
+            rows = connection.execute("""SELECT x, y, z, rotation, scale, flip, id
+                FROM journal ORDER BY seq""").fetchall()
+            connection.executemany("""UPDATE images SET
+                x = ?, y = ?, z = ?, rotation = ?, scale = ?, flip = ?
+                WHERE id == ?""", rows)
+            connection.execute("DELETE FROM journal")
+        return len(rows)
+
+
+    def clearJournal(self) -> None:
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM journal")
+
+
+    def storeImages(self, rows: Iterator[tuple[dict, bytes]]) -> int:
+        # rows are committed together, in transactions of at most
+        # STORE_TRANSACTION_BYTES of image data or STORE_TRANSACTION_ROWS rows
+        # a failed transaction is rolled back and nothing after it is stored
+        connection = self.connection()
+        stored = 0
+        pending = 0
+        size = 0
+        try:
+            for entry, data in rows:
+                self.insertImage(entry, data)
+                pending += 1
+                size += len(data)
+                if size >= system.STORE_TRANSACTION_BYTES or pending >= system.STORE_TRANSACTION_ROWS:
+                    connection.commit()
+                    stored += pending
+                    pending = 0
+                    size = 0
+            connection.commit()
+            stored += pending
+        except (sqlite3.Error, OSError) as error:
+            connection.rollback()
+            print(f"storing images failed after {stored} images, transaction rolled back: {error}")
+
+        self.rows_written = stored
+        return stored
+
+
+    def insertImage(self, entry: dict, data: bytes) -> None:
+        # does not commit, see storeImages
+        assert(data)
+
+        digest = entry.get("hash")
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+
+        self.addBlob(digest, data)
+        self.connection().execute("""INSERT INTO images
+            (id, path, type, ctime, mtime, x, y, z, rotation, scale, flip, blob)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [entry["id"], entry["path"], entry["type"], entry["ctime"], entry["mtime"],
+            entry["x"], entry["y"], entry["z"], entry["rotation"], entry["scale"], entry["flip"],
+            digest])
+
+
+    def addBlob(self, digest: str, data: bytes) -> None:
+        # the data is only written the first time a hash is seen
+        connection = self.connection()
+        cursor = connection.execute("UPDATE blobs SET refs = refs + 1 WHERE hash == ?", [digest])
+        if cursor.rowcount == 0:
+            size = TiledGraphicsItem.readSize(data)
+            connection.execute("INSERT INTO blobs (hash, refs, image, width, height) VALUES (?, ?, ?, ?, ?)",
+                [digest, 1, data, size.width(), size.height()])
+
+
+    def deleteItems(self, connection: sqlite3.Connection, item_ids: list[int]) -> None:
+        # rows of deleted items are purged together, blobs and mipmaps
+        # go with the last image using them
+        if not item_ids:
             return
 
-        # todo
-        image: bytes = None
-        with open(item.source_path, "rb") as fp:
-            image = fp.read()
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS deleted(id INTEGER PRIMARY KEY)")
+        connection.execute("DELETE FROM temp.deleted")
+        connection.executemany("INSERT INTO temp.deleted VALUES (?)", [[item_id] for item_id in item_ids])
+        connection.execute("""UPDATE blobs SET refs = refs -
+            (SELECT COUNT(*) FROM images JOIN temp.deleted USING (id) WHERE images.blob == blobs.hash)
+            WHERE hash IN (SELECT blob FROM images JOIN temp.deleted USING (id))""")
+        connection.execute("DELETE FROM images WHERE id IN temp.deleted")
+        # the ids may be reused by new items
+        connection.execute("DELETE FROM journal WHERE id IN temp.deleted")
+        connection.execute("DELETE FROM mipmaps WHERE hash IN (SELECT hash FROM blobs WHERE refs <= 0)")
+        connection.execute("DELETE FROM blobs WHERE refs <= 0")
+        connection.execute("DELETE FROM temp.deleted")
+
+
+    def getImage(self, item_id: int) -> bytes:
+        cursor = self.connection().execute("""SELECT blobs.image FROM images
+            JOIN blobs ON blobs.hash == images.blob
+            WHERE images.id == ?""", [item_id])
+        row = cursor.fetchone()
+        if row is None:
+            # deleted while a worker was still decoding it
+            return b""
+        return row[0]
+
+
+    def getBlob(self, digest: str) -> bytes:
+        cursor = self.connection().execute("SELECT image FROM blobs WHERE hash == ?", [digest])
+        row = cursor.fetchone()
+        if row is None:
+            return b""
+        return row[0]
+
+
+    def getMissingMipmaps(self, limit: int) -> list[str]:
+        cursor = self.connection().execute("""SELECT hash FROM blobs
+            WHERE hash NOT IN (SELECT hash FROM mipmaps WHERE level == 0)
+            LIMIT ?""", [limit])
+        return [row[0] for row in cursor]
+
+
+    def loadMipmaps(self, digest: str) -> list[tuple[int, bytes]]:
+        cursor = self.connection().execute("""SELECT level, image FROM mipmaps
+            WHERE hash == ? AND level > 0""", [digest])
+        return [(row[0], row[1]) for row in cursor]
+
+
+    def storeMipmaps(self, digest: str, levels: list[tuple[int, bytes]]) -> None:
+        rows = [(digest, 0, None)]
+        for level, data in levels:
+            rows.append((digest, level, data))
+
+        connection = self.connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO mipmaps VALUES (?, ?, ?)", rows)
+
+
+    def backup(self, file_path: str, progress: callable) -> sqlite3.Connection:
+        # copied in steps of pages, readers and writers of the project wait
+        # only for a single step; a change from another connection restarts it
+        target = sqlite3.connect(file_path, check_same_thread=False)
+        try:
+            self.connection().backup(target, pages=system.BACKUP_STEP_PAGES,
+                progress=lambda _status, remaining, total: progress(total - remaining, total))
+        except sqlite3.Error:
+            target.close()
+            raise
+        return target
+
+
+    def getFileSize(self) -> int:
+        size = 0
+        for path in (self.file_path, self.file_path + "-wal"):
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+        return size
+
+
+    def getFreeRatio(self) -> float:
+        connection = self.connection()
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        total_pages = connection.execute("PRAGMA page_count").fetchone()[0]
+        if total_pages == 0:
+            return 0.0
+        return free_pages / total_pages
+
+
+    def isIncremental(self) -> bool:
+        mode = self.connection().execute("PRAGMA auto_vacuum").fetchone()[0]
+        return mode == 2
+
+
+    def reclaim(self, pages: int, threshold: float) -> int:
+        if not self.isIncremental() or self.getFreeRatio() <= threshold:
+            return 0
+
+        # free pages in small steps, releasing the write lock in between
+        size = self.getFileSize()
+        connection = self.connection()
+        while self.getFreeRatio() > 0.0:
+            # executescript steps the pragma to completion, execute() frees a single page
+            connection.executescript(f"PRAGMA incremental_vacuum({pages});")
+            time.sleep(0.01)
+
+        connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return size - self.getFileSize()
+
 
-        assert(image)
+    def compact(self) -> int:
+        size = self.getFileSize()
+        connection = self.connection()
+        if self.isIncremental():
+            connection.executescript("PRAGMA incremental_vacuum;")
+        else:
+            # rewrites the whole file once to enable incremental auto vacuum
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
 
-        x = int(item.pos().x())
-        y = int(item.pos().y())
-        z = item.zValue()
-        scale = item.scale()
-        flip = item.is_flipped
-        rotation = item.getRotation()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return size - self.getFileSize()
 
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
-        cursor.execute("INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            [item.id, item.path, item.type, item.ctime, item.mtime, x, y, z, rotation, scale, flip, image])
-        connection.commit()
 
+class ItemLoadWorker(QObject):
 
-    def deleteItem(self, item: GraphicsItem) -> None:
-        if self.file_path == "":
+    finished = pyqtSignal(int)
+    progress = pyqtSignal(object, int, int, int)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        self.view: GraphicsView = None
+        self.view_rect = QRectF()
+        self.cancelled = False
+        # results of a cancelled load may still be queued, they carry its generation
+        self.generation = 0
+        self.run_generation = 0
+        self.start_time = 0.0
+        self.total = 0
+        self.visible_total = 0
+        self.count = 0
+        self.batch = []
+        self.batch_time = 0.0
+        self.results = queue.Queue()
+
+        # pool threads are kept alive so their connections are reused
+        self.pool = QThreadPool(self)
+        self.pool.setExpiryTimeout(-1)
+        # bounds the number of image blobs in memory at once
+        self.slots = QSemaphore(self.pool.maxThreadCount() * 2)
+
+
+    def run(self) -> None:
+        self.start_time = time.perf_counter()
+        self.run_generation = self.generation
+        self.total = system.sql.countImages()
+        self.visible_total = system.sql.countImages(self.view_rect)
+        self.count = 0
+        self.batch_time = self.start_time
+
+        submitted = 0
+        for entry in system.sql.loadImages(self.view_rect):
+            if self.cancelled:
+                break
+            while not self.slots.tryAcquire(1, 5):
+                self.collect()
+            self.pool.start(functools.partial(self.decode, dict(entry)))
+            submitted += 1
+            self.collect()
+
+        while self.count < submitted:
+            self.collect(0.005)
+        self.emitBatch()
+
+        system.sql.release()
+        self.finished.emit(self.run_generation)
+
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.generation += 1
+
+
+    def decode(self, entry: dict) -> None:
+        # runs on the pool, pixmaps are created on the GUI thread
+        image = QImage()
+        try:
+            if self.cancelled:
+                return
+            data = system.sql.getBlob(entry["hash"])
+            size = TiledGraphicsItem.readSize(data)
+            levels = system.sql.loadMipmaps(entry["hash"])
+            if TiledGraphicsItem.isTiled(size):
+                image = TiledGraphicsItem.readPreview(data)
+                entry["tiled"] = True
+                entry["size"] = size
+            elif entry["visible"]:
+                image = QImage.fromData(data)
+            else:
+                # off-screen items show the smallest level until the pixmap cache loads them
+                entry["size"] = size
+                levels = sorted(levels)[-1:]
+            mipmaps = {}
+            for level, level_data in levels:
+                mipmaps[level] = QImage.fromData(level_data)
+            entry["mipmaps"] = mipmaps
+        except ValueError as error:
+            print(f"cannot decode image {entry['id']}: {error}")
+        finally:
+            self.results.put((entry, image))
+            self.slots.release()
+
+
+    def collect(self, timeout: float = 0.0) -> None:
+        try:
+            if timeout > 0.0:
+                result = self.results.get(timeout=timeout)
+            else:
+                result = self.results.get_nowait()
+            while True:
+                self.batch.append(result)
+                self.count += 1
+                result = self.results.get_nowait()
+        except queue.Empty:
+            pass
+
+        # emit full batches, or whatever is ready once per frame
+        if len(self.batch) >= system.batch_size:
+            self.emitBatch()
+        elif self.batch and self.count == self.visible_total:
+            self.emitBatch()
+        elif self.batch and time.perf_counter() - self.batch_time > system.FRAME_INTERVAL:
+            self.emitBatch()
+
+
+    def emitBatch(self) -> None:
+        if self.batch:
+            self.progress.emit(self.batch, self.count, self.total, self.run_generation)
+        self.batch = []
+        self.batch_time = time.perf_counter()
+
+
+class ItemDropWorker(QObject):
+
+    finished = pyqtSignal(int, list, list, int)
+    progress = pyqtSignal(object, int, int, int)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        self.view: GraphicsView = None
+        self.urls: list[QUrl] = []
+        self.images: list[QImage] = []
+        self.pos: QPointF = None
+        self.cancelled = False
+        # results of a drop into a project that was closed may still be queued
+        self.generation = 0
+        self.run_generation = 0
+        self.downloader = network.Downloader()
+        self.total = 0
+        self.count = 0
+        self.item_ids = []
+        # names and reasons of files that could not be added
+        self.failed = []
+        # decoded images waiting to be stored
+        self.pending = []
+        self.pending_size = 0
+        self.stored_size = 0
+        self.batch = []
+        self.batch_time = 0.0
+        self.timings = {}
+        self.results = queue.Queue()
+
+        self.pool = QThreadPool(self)
+        self.pool.setExpiryTimeout(-1)
+        # downloads wait on the network, not the cpu
+        self.pool.setMaxThreadCount(max(self.pool.maxThreadCount(), system.MAX_DOWNLOADS))
+        # bounds the number of files in memory at once
+        self.slots = QSemaphore(self.pool.maxThreadCount() * 2)
+
+
+    def run(self) -> None:
+        start_time = time.perf_counter()
+        self.run_generation = self.generation
+        # the number of files in dropped folders is unknown until walked
+        self.total = len(self.images) + len(self.urls)
+        if ingest.hasFolders(self.urls):
+            self.total = 0
+        self.count = 0
+        self.item_ids = []
+        self.failed = []
+        self.pending = []
+        self.pending_size = 0
+        self.stored_size = 0
+        self.batch_time = start_time
+        self.timings = dict.fromkeys(ingest.STAGES, 0.0)
+
+        submitted = 0
+        for source in itertools.chain(self.images, ingest.walkUrls(self.urls, self.failed)):
+            while not self.slots.tryAcquire(1, 5):
+                self.collect()
+            if self.cancelled:
+                self.slots.release()
+                break
+            self.pool.start(functools.partial(self.process, source))
+            submitted += 1
+            self.collect()
+
+        # files already being read are still added
+        while self.count < submitted:
+            self.collect(0.005)
+        self.store()
+        self.emitBatch()
+        self.downloader.close()
+
+        elapsed = time.perf_counter() - start_time
+        if len(self.item_ids) > 1:
+            stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.timings.items())
+            print(f"dropped {len(self.item_ids)} images in {elapsed:.2f}s ({stages})")
+        if self.stored_size > 0:
+            store_time = max(self.timings["store"], 1e-6)
+            megabytes = self.stored_size / 1024 / 1024
+            print(f"stored {megabytes:.1f} MB at {megabytes / store_time:.1f} MB/s")
+
+        system.sql.release()
+        self.finished.emit(0, self.item_ids, self.failed, self.run_generation)
+
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.downloader.cancelled = True
+
+
+    def process(self, source: QUrl | QImage) -> None:
+        # runs on the pool, everything up to storing the image
+        result = (None, QImage(), b"", {})
+        try:
+            if self.cancelled:
+                return
+            if isinstance(source, QImage):
+                result = ingest.processImage(source)
+            else:
+                result = ingest.process(source, self.downloader)
+        except (OSError, ValueError, http.client.HTTPException, network.DownloadError) as error:
+            name = "pasted image" if isinstance(source, QImage) else source.toString()
+            if not self.cancelled:
+                print(f"cannot read {name}: {error}")
+                self.failed.append(f"{name}: {error}")
+        finally:
+            self.results.put(result)
+            self.slots.release()
+
+
+    def collect(self, timeout: float = 0.0) -> None:
+        results = []
+        try:
+            if timeout > 0.0:
+                results.append(self.results.get(timeout=timeout))
+            while True:
+                results.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+
+        for entry, image, data, timings in results:
+            self.count += 1
+            for stage, seconds in timings.items():
+                self.timings[stage] += seconds
+            if entry is None:
+                continue
+
+            entry["id"] = system.item_registry.allocate()
+            # centered on the drop position, packed afterwards
+            size = entry.get("size", image.size())
+            entry["x"] = int(self.pos.x() - size.width() / 2)
+            entry["y"] = int(self.pos.y() - size.height() / 2)
+            entry["z"] = system.z_order.reserve()
+            entry.update({"rotation": 0.0, "scale": 1.0, "flip": False})
+            self.pending.append((entry, image, data))
+            self.pending_size += len(data)
+
+        if self.pending_size >= system.STORE_TRANSACTION_BYTES:
+            self.store()
+        elif len(self.pending) >= system.STORE_TRANSACTION_ROWS:
+            self.store()
+
+        if len(self.batch) >= system.batch_size:
+            self.emitBatch()
+        elif self.batch and time.perf_counter() - self.batch_time > system.FRAME_INTERVAL:
+            self.emitBatch()
+
+
+    def store(self) -> None:
+        # pending images are written in one transaction, only stored ones are shown
+        if not self.pending:
             return
 
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM images WHERE id == ?", [item.id])
-        connection.commit()
+        start = time.perf_counter()
+        stored = system.sql.storeImages((entry, data) for entry, _image, data in self.pending)
+        self.stored_size += sum(len(data) for _entry, _image, data in self.pending[:stored])
+        self.timings["store"] += time.perf_counter() - start
 
+        for entry, image, data in self.pending[:stored]:
+            self.item_ids.append(entry["id"])
+            self.batch.append((entry, image))
+        for entry, _image, _data in self.pending[stored:]:
+            system.item_registry.release(entry["id"])
 
-    def getImage(self, item: GraphicsItem) -> bytes:
-        connection = sqlite3.connect(self.file_path)
-        cursor = connection.cursor()
-        cursor.execute("SELECT image FROM images WHERE id == ?", [item.id])
-        data = cursor.fetchall()[0][0]
-        return data
+        self.pending = []
+        self.pending_size = 0
 
 
-class ItemLoadWorker(QObject):
+    def emitBatch(self) -> None:
+        if self.batch:
+            self.progress.emit(self.batch, self.count, self.total, self.run_generation)
+        self.batch = []
+        self.batch_time = time.perf_counter()
+
+
+class MipmapWorker(QObject):
 
     finished = pyqtSignal(int)
-    progress = pyqtSignal(GraphicsItem, int, int)
+    progress = pyqtSignal(object)
 
     def __init__(self, parent=None) -> None:
         super().__init__(parent=parent)
-        self.view: GraphicsView = None
+        self.cancelled = False
 
 
     def run(self) -> None:
-        image_data = system.sql.loadImages()
-        total = len(image_data)
-
-        i = 1
-        for entry in image_data:
-            x = entry["x"]
-            y = entry["y"]
-            pos = QPointF(x, y)
-
-            item = GraphicsItem(pos=pos, drop=False, **entry)
-            self.progress.emit(item, i, total)
-            i += 1
-        
+        self.cancelled = False
+        try:
+            digests = system.sql.getMissingMipmaps(system.batch_size)
+            while digests and not self.cancelled:
+                batch = []
+                for digest in digests:
+                    if self.cancelled:
+                        break
+                    data = system.sql.getBlob(digest)
+                    levels = {}
+                    # tiled images are never decoded whole, they have their own levels
+                    if not TiledGraphicsItem.isTiled(TiledGraphicsItem.readSize(data)):
+                        levels = self.createLevels(QImage.fromData(data))
+                    encoded = [(level, self.encode(level_image)) for level, level_image in levels.items()]
+                    system.sql.storeMipmaps(digest, encoded)
+                    batch.append((digest, levels))
+
+                self.progress.emit(batch)
+                digests = system.sql.getMissingMipmaps(system.batch_size)
+        except sqlite3.Error as error:
+            # blobs without mipmaps are picked up by the next run
+            print(f"creating mipmaps failed: {error}")
+
+        system.sql.release()
         self.finished.emit(0)
 
 
-class ItemDropWorker(QObject):
+    def createLevels(self, image: QImage) -> dict[int, QImage]:
+        levels = {}
+        level = 1
+        width = image.width() // 2
+        height = image.height() // 2
+        while max(width, height) >= system.MIPMAP_MIN_SIZE:
+            image = image.scaled(width, height,
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation)
+            levels[level] = image
+            level += 1
+            width = image.width() // 2
+            height = image.height() // 2
+        return levels
+
 
-    finished = pyqtSignal(int, list)
-    progress = pyqtSignal(GraphicsItem, int, int)
+    def encode(self, image: QImage) -> bytes:
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        if image.hasAlphaChannel():
+            image.save(buffer, "PNG")
+        else:
+            image.save(buffer, "JPG", 90)
+        return data.data()
+
+
+class CompactWorker(QObject):
+
+    finished = pyqtSignal(int, bool, bool)
 
     def __init__(self, parent=None) -> None:
         super().__init__(parent=parent)
-        self.view: GraphicsView = None
-        self.urls: list[QUrl] = None
-        self.pos: QPointF = None
+        self.full = False
 
 
     def run(self) -> None:
-        urls = self.urls
-        pos = self.pos
-
-        items = []
-        total = len(urls)
-
-        i = 1
-        for url in urls:
-            if url.isLocalFile():
-                path = url.path()
-                item = self.view.addItem(path=path, pos=pos)
-                items.append(item)
-                self.progress.emit(item, i, total)
-                i += 1
+        reclaimed = 0
+        is_compacted = True
+        try:
+            if self.full:
+                reclaimed = system.sql.compact()
             else:
-                s_url = url.url()
-                with urllib.request.urlopen(s_url) as response:
-                    with tempfile.NamedTemporaryFile() as temp_file:
-                        shutil.copyfileobj(response, temp_file)
-                        path = temp_file.name
-                        item = self.view.addItem(path=path, pos=pos, url=url)
-                        items.append(item)
-                        self.progress.emit(item, i, total)
-                        i += 1
-
-        self.finished.emit(0, items)
+                reclaimed = system.sql.reclaim(system.COMPACT_STEP_PAGES, system.COMPACT_FREE_RATIO)
+        except sqlite3.Error as error:
+            is_compacted = False
+            print(f"compacting failed: {error}")
+
+        system.sql.release()
+        self.finished.emit(reclaimed, self.full, is_compacted)
+
+
+class SaveWorker(QObject):
+
+    finished = pyqtSignal(int, bool, object)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        # taken on the GUI thread, nothing in it refers to items: view state,
+        # dirty columns, journal generation and ids of deleted items, the
+        # project file it was taken from and the file to copy the project to
+        self.snapshot = {}
+
+
+    def run(self) -> None:
+        start_time = time.perf_counter()
+        snapshot = self.snapshot
+        is_saved = True
+        written = 0
+        try:
+            if snapshot["target"]:
+                connection = system.sql.backup(snapshot["target"], self.progress.emit)
+                try:
+                    written = system.sql.writeSnapshot(snapshot, connection)
+                finally:
+                    connection.close()
+            else:
+                written = system.sql.writeSnapshot(snapshot)
+        except sqlite3.Error as error:
+            is_saved = False
+            print(f"saving failed, transaction rolled back: {error}")
+        else:
+            print(f"saved {written} items in {time.perf_counter() - start_time:.2f}s")
+
+        system.sql.release()
+        self.finished.emit(written, is_saved, snapshot)
+
+
+class AutosaveWorker(QObject):
+
+    finished = pyqtSignal(int, bool, object)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        # states of the items changed since the previous autosave
+        self.rows: list[list] = []
+        self.generation = 0
+
+
+    def run(self) -> None:
+        is_saved = True
+        written = 0
+        try:
+            written = system.sql.writeJournal(self.generation, self.rows)
+        except sqlite3.Error as error:
+            is_saved = False
+            print(f"autosave failed: {error}")
+
+        system.sql.release()
+        self.finished.emit(written, is_saved, self.rows)
@@ -17,6 +17,8 @@ class GraphicsItem(QGraphicsPixmapItem):
 
     def __init__(self, **kwargs: dict) -> None:
         super().__init__()
+        # columns changed since the last save
+        self.dirty: set[str] = set()
 
         item_id = kwargs.get("id")
         path = kwargs.get("path")
@@ -31,35 +33,23 @@ class GraphicsItem(QGraphicsPixmapItem):
         ctime = kwargs.get("ctime")
         mtime = kwargs.get("mtime")
 
-        basename = os.path.basename(path)
+        basename = GraphicsItem.getBaseName(path, file_type)
         if url != "":
-            basename = os.path.basename(url)
-        name, ext = os.path.splitext(basename)
-        ext_changed = False
-        if ext == "":
-            ext = "." + file_type.lower()
-            if ext == ".jpeg":
-                ext = ".jpg"
-            ext_changed = True
-        if name == ext:
-            with tempfile.NamedTemporaryFile() as temp_file:
-                basename = os.path.basename(temp_file.name)
-        if ext_changed:
-            basename += ext
+            basename = GraphicsItem.getBaseName(url, file_type)
 
-        if item_id:
-            system.item_ids.append(item_id)
-        else:
-            item_id = system.getItemID()
+        if item_id is None:
+            item_id = system.item_registry.allocate()
 
+        image = kwargs.get("image")
         if is_drop:
-            pixmap = QPixmap(path)
             ctime = time.time()
             mtime = os.path.getmtime(path)
-        else:
-            image = kwargs.get("image")
-            pixmap = QPixmap()
-            pixmap.loadFromData(image)
+        # items showing the same blob share one pixmap
+        pixmap = kwargs.get("pixmap")
+        if pixmap is None and image is None:
+            pixmap = QPixmap(path)
+        elif pixmap is None:
+            pixmap = QPixmap.fromImage(image)
 
         self.id = item_id
         self.path = basename
@@ -67,12 +57,21 @@ class GraphicsItem(QGraphicsPixmapItem):
         self.ctime = ctime
         self.mtime = mtime
         self.type = file_type
+        # content hash of the stored image data
+        self.hash = kwargs.get("hash")
+        system.item_registry.register(self)
 
+        # shared with every item showing the same blob, see PixmapCache
+        self.mipmaps = system.pixmap_cache.getMipmaps(self.hash)
+
+        # geometry stays the same when the pixmap is unloaded or a preview
+        self.image_size = QSizeF(kwargs.get("size", pixmap.size()))
         self.setPixmap(pixmap)
         self.setPos(pos)
         self.setScale(scale)
         self.setRotation(math.degrees(rotation))
         self.setZValue(z_value)
+        system.z_order.track(z_value)
 
         self.is_flipped = False
         if is_flipped:
@@ -86,21 +85,96 @@ class GraphicsItem(QGraphicsPixmapItem):
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges, True)
         self.setShapeMode(QGraphicsPixmapItem.ShapeMode.BoundingRectShape)
+        self.dirty.clear()
+        system.item_registry.changed.discard(self.id)
+
+
+    @staticmethod
+    def getBaseName(path: str, file_type: str) -> str:
+        basename = os.path.basename(path)
+        name, ext = os.path.splitext(basename)
+        ext_changed = False
+        if ext == "":
+            ext = "." + file_type.lower()
+            if ext == ".jpeg":
+                ext = ".jpg"
+            ext_changed = True
+        if name == ext:
+            with tempfile.NamedTemporaryFile() as temp_file:
+                basename = os.path.basename(temp_file.name)
+        if ext_changed:
+            basename += ext
+        return basename
 
 
     def itemChange(self, change: QGraphicsItem.GraphicsItemChange, value: any) -> any:
-        if self.scene():
-            if change == QGraphicsItem.GraphicsItemChange.ItemSelectedHasChanged:
-                self.sendToFront()
-            elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged:
-                self.sendToFront()
+        if change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged:
+            self.markDirty("x", "y")
+        elif change == QGraphicsItem.GraphicsItemChange.ItemZValueHasChanged:
+            self.markDirty("z")
+        elif change == QGraphicsItem.GraphicsItemChange.ItemScaleHasChanged:
+            self.markDirty("scale")
+        elif change == QGraphicsItem.GraphicsItemChange.ItemRotationHasChanged:
+            self.markDirty("rotation")
+        elif change == QGraphicsItem.GraphicsItemChange.ItemTransformHasChanged:
+            self.markDirty("rotation")
         return super().itemChange(change, value)
 
 
+    def markDirty(self, *columns: str) -> None:
+        # written by the next save, journaled by the next autosave
+        self.dirty.update(columns)
+        system.item_registry.changed.add(self.id)
+
+
+    def normalizeTransform(self) -> None:
+        # items rotated through item groups carry it in their transform,
+        # it is moved into pos, rotation and scale around the local origin
+        if self.transform().isIdentity() and self.transformOriginPoint().isNull():
+            return
+        t = self.sceneTransform()
+        pos = t.map(QPointF())
+        self.setTransform(QTransform())
+        self.setTransformOriginPoint(QPointF())
+        self.setPos(pos)
+        self.setRotation(math.degrees(math.atan2(t.m12(), t.m11())))
+        self.setScale(math.hypot(t.m11(), t.m12()))
+
+
     def flip(self) -> None:
-        mirror = self.pixmap().transformed(QTransform().scale(-1, 1))
-        self.setPixmap(mirror)
+        # mirrored when painted, so mipmaps need no flipped copies
         self.is_flipped = not self.is_flipped
+        self.markDirty("flip")
+        self.update()
+
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(QPointF(), self.image_size)
+
+
+    def shape(self) -> QPainterPath:
+        path = QPainterPath()
+        path.addRect(self.boundingRect())
+        return path
+
+
+    def unloadPixmap(self) -> None:
+        # the pixmap cache decodes it again from the project when visible
+        self.setPixmap(QPixmap())
+
+
+    def getMipmap(self, scale: float) -> QPixmap:
+        # largest level that still has at least one pixel per screen pixel
+        level = 0
+        if scale > 0.0 and scale < 1.0:
+            level = int(math.log2(1.0 / scale))
+        while level > 0 and level not in self.mipmaps:
+            level -= 1
+        if level == 0 and self.pixmap().isNull() and self.mipmaps:
+            level = min(self.mipmaps)
+        if level == 0:
+            return self.pixmap()
+        return self.mipmaps[level]
 
 
     def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget) -> None:
@@ -108,15 +182,20 @@ class GraphicsItem(QGraphicsPixmapItem):
         color = QColor(Qt.GlobalColor.black)
 
         if self.isSelected():
-            # override selection border
-            option.state = QStyle.StateFlag.State_None
-            super().paint(painter, option, widget)
             width = 2
             color = QColor("#33CCCC")
-        else:
-            super().paint(painter, option, widget)
 
         rect = self.boundingRect()
+        is_smooth = self.transformationMode() == Qt.TransformationMode.SmoothTransformation
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, is_smooth)
+        if self.is_flipped:
+            painter.translate(rect.right() + rect.left(), 0.0)
+            painter.scale(-1.0, 1.0)
+        self.paintImage(painter, option, rect)
+        painter.restore()
+
         pen = QPen()
         pen.setWidth(width)
         pen.setCosmetic(True)
@@ -128,14 +207,26 @@ class GraphicsItem(QGraphicsPixmapItem):
         painter.drawRect(rect)
 
 
+    def paintImage(self, painter: QPainter, option: QStyleOptionGraphicsItem, rect: QRectF) -> None:
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        pixmap = self.getMipmap(scale)
+        if pixmap.isNull():
+            painter.fillRect(rect, QColor("#333333"))
+        else:
+            painter.drawPixmap(rect, pixmap, QRectF(pixmap.rect()))
+
+
+    def getState(self) -> dict:
+        return {
+            "x": int(self.pos().x()),
+            "y": int(self.pos().y()),
+            "z": self.zValue(),
+            "rotation": self.getRotation(),
+            "scale": self.scale(),
+            "flip": self.is_flipped,
+        }
+
+
     def getRotation(self) -> float:
         t = self.sceneTransform()
         return math.atan2(t.m12(), t.m11())
-
-
-    def sendToFront(self) -> None:
-        max_z = 0
-        colliding_items = self.collidingItems(Qt.ItemSelectionMode.IntersectsItemBoundingRect)
-        for colliding_item in colliding_items:
-            max_z = max(max_z, colliding_item.zValue())
-        self.setZValue(max_z + 1)
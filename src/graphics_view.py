@@ -8,14 +8,13 @@ import rpack
 import shutil
 import time
 
-from PIL import (Image, UnidentifiedImageError)
 from PyQt6.QtCore import *
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 
 import system
 import commands
-from graphics_item import GraphicsItem
+from selection_transform import SelectionTransform
 
 
 class GraphicsView(QGraphicsView):
@@ -28,6 +27,7 @@ class GraphicsView(QGraphicsView):
         scene.selectionChanged.connect(self.onSelectionChanged)
         self._mouse_last_press_position = QPointF()
         self._mouse_last_drop_position = QPointF()
+        self.selection_transform = SelectionTransform()
 
         self.transformation_mode = Qt.TransformationMode.SmoothTransformation
         self.grayscale_effect = QGraphicsColorizeEffect()
@@ -40,12 +40,15 @@ class GraphicsView(QGraphicsView):
         self.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
         self.setStyleSheet("background-color: #100111111;")
 
+        self.cache_timer = QTimer(self)
+        self.cache_timer.setSingleShot(True)
+        self.cache_timer.setInterval(100)
+        self.cache_timer.timeout.connect(self.updatePixmapCache)
 
-    def load(self):
-        system.item_load_thread.start()
-        # todo
-        self.parent().progress_bar.show()
 
+    def load(self):
+        system.item_registry.reset(system.sql.getNextImageID())
+        system.z_order.reset()
         view_data = system.sql.loadView()
         view_x = view_data["x"]
         view_y = view_data["y"]
@@ -59,14 +62,25 @@ class GraphicsView(QGraphicsView):
         self.scale(view_scale, view_scale)
         self.centerOn(view_pos)
 
+        # load what the saved view shows first
+        view_rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        system.item_load_worker.view_rect = view_rect
+        system.item_load_worker.cancelled = False
+        system.item_load_thread.start()
+        # todo
+        self.parent().progress_bar.show()
+
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
         if event.button() == Qt.MouseButton.LeftButton:
             self._mouse_last_press_position = event.position()
-            if event.modifiers() == Qt.KeyboardModifier.ShiftModifier:
-                event.accept()
-                return
-            if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+            if event.modifiers() in (Qt.KeyboardModifier.ShiftModifier, Qt.KeyboardModifier.ControlModifier):
+                items = self.scene().selectedItems()
+                text = "Rotate"
+                if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+                    text = "Scale"
+                if len(items) > 0:
+                    self.selection_transform.begin(text, items)
                 event.accept()
                 return
         if event.button() == Qt.MouseButton.RightButton:
@@ -77,12 +91,23 @@ class GraphicsView(QGraphicsView):
             event.accept()
             return
         super().mousePressEvent(event)
+        # raised once when an interaction starts, not on every move
+        if event.button() == Qt.MouseButton.LeftButton:
+            system.z_order.raiseItems(self.scene().selectedItems())
 
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
+        if event.button() == Qt.MouseButton.LeftButton and self.selection_transform.isActive():
+            command = self.selection_transform.end()
+            if command:
+                system.undo_stack.push(command)
+            event.accept()
+            return
         super().mouseReleaseEvent(event)
         if event.button() == Qt.MouseButton.LeftButton:
             items = self.scene().selectedItems()
+            # rubber band selections are only known on release
+            system.z_order.raiseItems(items)
             if len(items) > 0:
                 p1 = self.mapToScene(self._mouse_last_press_position.toPoint())
                 p2 = self.mapToScene(event.position().toPoint())
@@ -125,34 +150,20 @@ class GraphicsView(QGraphicsView):
 
 
     def dropEvent(self, event: QDropEvent) -> None:
-        # todo: cannot directly send event/mimedata to worker
         mimedata = event.mimeData()
         pos = self.mapToScene(event.position().toPoint())
         self._mouse_last_drop_position = pos
 
-        if mimedata.hasUrls():
-            urls = mimedata.urls()
-            system.item_drop_worker.urls = urls
-            system.item_drop_worker.pos = pos
-            system.item_drop_thread.start()
-            # todo
-            self.parent().progress_bar.show()
-        elif mimedata.hasImage():
-            print("image: ")
-
-
-    def addItem(self, path: str, pos: QPointF, url="", **kwargs: dict) -> GraphicsItem:
-        file_type = None
-        try:
-            img = Image.open(path)
-            file_type = img.format
-        except UnidentifiedImageError:
-            return None
-
-        item = GraphicsItem(path=path, pos=pos, type=file_type, url=url, **kwargs)
-        item.setTransformationMode(self.transformation_mode)
-        system.sql.storeItem(item)
-        return item
+        # browsers offer the pixels as well as the url, no download is needed then;
+        # local files are read as they are, keeping their name and encoding
+        is_local = any(url.isLocalFile() for url in mimedata.urls())
+        if mimedata.hasImage() and not is_local:
+            image = mimedata.imageData()
+            if isinstance(image, QPixmap):
+                image = image.toImage()
+            self.parent().ingestUrls([], pos, [image])
+        elif mimedata.hasUrls():
+            self.parent().ingestUrls(mimedata.urls(), pos)
 
 
     def panView(self, event: QMouseEvent) -> None:
@@ -166,6 +177,7 @@ class GraphicsView(QGraphicsView):
         delta = new_pos - old_pos
         self.translate(delta.x(), delta.y())
         self._mouse_last_press_position = event.position()
+        self.cache_timer.start()
 
 
     def zoomView(self, event: QWheelEvent) -> None:
@@ -197,21 +209,24 @@ class GraphicsView(QGraphicsView):
         new_pos = self.mapToScene(pos)
         delta = new_pos - old_pos
         self.translate(delta.x(), delta.y())
+        self.cache_timer.start()
 
 
     def packSelection(self) -> None:
         items = self.scene().selectedItems()
-        group = self.scene().createItemGroup(items)
-        rect_sizes = []
+        if not len(items) > 0:
+            return
 
+        rect_sizes = []
+        bounding_rect = QRectF()
         for item in items:
             scale = item.scale()
             width = int(item.boundingRect().width() * scale)
             height = int(item.boundingRect().height() * scale)
             rect = (width, height)
             rect_sizes.append(rect)
+            bounding_rect = bounding_rect.united(item.sceneBoundingRect())
 
-        bounding_rect = group.boundingRect()
         origin = bounding_rect.topLeft()
 
         packed_positions = rpack.pack(sizes=rect_sizes)
@@ -222,7 +237,22 @@ class GraphicsView(QGraphicsView):
             pos = origin + QPointF(x, y)
             item.setPos(pos)
 
-        self.scene().destroyItemGroup(group)
+
+    def resetSelectionTransforms(self) -> None:
+        SelectionTransform.reset(self.scene().selectedItems())
+
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self.cache_timer.start()
+
+
+    def updatePixmapCache(self) -> None:
+        # keep pixmaps for the viewport and half a viewport around it
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        margin = max(rect.width(), rect.height()) / 2
+        rect.adjust(-margin, -margin, margin, margin)
+        system.pixmap_cache.update(self.scene().items(rect))
 
 
     def contextMenuEvent(self, event: QContextMenuEvent) -> None:
@@ -253,6 +283,32 @@ class GraphicsView(QGraphicsView):
         self.setSceneRect(QRectF(new_top_left, new_bottom_right))
 
 
+    def setSelection(self, items: list[QGraphicsItem], clear: bool = False) -> None:
+        # one selectionChanged for the whole batch instead of one per item
+        scene = self.scene()
+        blocked = scene.blockSignals(True)
+        if clear:
+            scene.clearSelection()
+        for item in items:
+            item.setSelected(True)
+        scene.blockSignals(blocked)
+        scene.selectionChanged.emit()
+
+
+    def selectAll(self) -> None:
+        self.setSelection(system.item_registry.items.values())
+
+
+    def invertSelection(self) -> None:
+        selected_ids = {item.id for item in self.scene().selectedItems()}
+        items = [item for item in system.item_registry.items.values() if item.id not in selected_ids]
+        self.setSelection(items, clear=True)
+
+
+    def clearSelection(self) -> None:
+        self.scene().clearSelection()
+
+
     def onSelectionChanged(self) -> None:
         selected_items = self.scene().selectedItems()
         if len(selected_items) > 0:
@@ -262,50 +318,23 @@ class GraphicsView(QGraphicsView):
 
 
     def rotateSelection(self, event: QMouseEvent) -> None:
-        items = self.scene().selectedItems()
-        if not len(items) > 0:
+        if not self.selection_transform.isActive():
             return
 
-        group = self.scene().createItemGroup(items)
-        center = group.boundingRect().center()
-        group.setTransformOriginPoint(center)
-
-        event_pos = self.mapToScene(event.position().toPoint())
-        mid_pos = group.mapToScene(center)
-        offset_pos = self.mapToScene(self._mouse_last_press_position.toPoint())
+        pivot = self.selection_transform.pivot
+        event_pos = self.mapToScene(event.position().toPoint()) - pivot
+        press_pos = self.mapToScene(self._mouse_last_press_position.toPoint()) - pivot
 
-        dx = event_pos - mid_pos
-        ax = math.atan2(dx.y(), dx.x())
-        dy = offset_pos - mid_pos
-        ay = math.atan2(dy.y(), dy.x())
-        rotation = math.degrees(ax - ay)
-
-        group.setRotation(group.rotation() + rotation)
-
-        self.scene().destroyItemGroup(group)
-        self._mouse_last_press_position = event.position()
+        ax = math.atan2(event_pos.y(), event_pos.x())
+        ay = math.atan2(press_pos.y(), press_pos.x())
+        self.selection_transform.rotate(math.degrees(ax - ay))
 
 
     def scaleSelection(self, event: QMouseEvent) -> None:
-        items = self.scene().selectedItems()
-        if not len(items) > 0:
+        if not self.selection_transform.isActive():
             return
 
-        # todo: get correct transform scale
-        # group = self.scene().createItemGroup(items)
-        # center = group.boundingRect().center()
-        # group.setTransformOriginPoint(center)
-
         event_pos = self.mapToScene(event.position().toPoint())
-        offset_pos = self.mapToScene(self._mouse_last_press_position.toPoint())
+        press_pos = self.mapToScene(self._mouse_last_press_position.toPoint())
         factor = 0.0005
-        scale = (event_pos - offset_pos).x() * factor
-
-        for item in items:
-            item_center = item.boundingRect().center()
-            # item.setTransformOriginPoint(item_center)
-            item.setScale(item.scale() + scale)
-
-        # group.setScale(group.scale() + scale)
-        # self.scene().destroyItemGroup(group)
-        self._mouse_last_press_position = event.position()
+        self.selection_transform.scale(math.exp((event_pos - press_pos).x() * factor))
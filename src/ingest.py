@@ -0,0 +1,173 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import os
+import time
+import hashlib
+from typing import Iterator
+
+from PyQt6.QtCore import *
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+
+from network import Downloader
+from graphics_item import GraphicsItem
+from tiled_graphics_item import TiledGraphicsItem
+
+
+# each dropped file is read once, every stage works on the same bytes
+STAGES = ("read", "encode", "probe", "hash", "decode", "store")
+
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+]
+
+
+# files with other extensions are skipped when walking folders
+EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def walkUrls(urls: list[QUrl], failed: list[str]) -> Iterator[QUrl]:
+    # folders are walked recursively as they are consumed, one directory
+    # listing open per level so memory does not grow with the file count
+    # folders that cannot be read are added to failed
+    for url in urls:
+        path = url.toLocalFile()
+        if not url.isLocalFile() or not os.path.isdir(path):
+            yield url
+            continue
+
+        stack = []
+        try:
+            stack.append(os.scandir(path))
+        except OSError as error:
+            print(f"cannot read {path}: {error}")
+            failed.append(f"{path}: {error}")
+        while stack:
+            try:
+                entry = next(stack[-1], None)
+            except OSError as error:
+                print(f"cannot read {path}: {error}")
+                failed.append(f"{path}: {error}")
+                entry = None
+            if entry is None:
+                stack.pop().close()
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(os.scandir(entry.path))
+                elif os.path.splitext(entry.name)[1].lower() in EXTENSIONS:
+                    yield QUrl.fromLocalFile(entry.path)
+            except OSError as error:
+                print(f"cannot read {entry.path}: {error}")
+                failed.append(f"{entry.path}: {error}")
+
+
+def hasFolders(urls: list[QUrl]) -> bool:
+    return any(url.isLocalFile() and os.path.isdir(url.toLocalFile()) for url in urls)
+
+
+def probeFormat(data: bytes) -> str:
+    for signature, file_type in SIGNATURES:
+        if data.startswith(signature):
+            return file_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def readUrl(url: QUrl, downloader: Downloader) -> tuple[str, bytes, float]:
+    if url.isLocalFile():
+        path = url.toLocalFile()
+        with open(path, "rb") as fp:
+            data = fp.read()
+        return path, data, os.path.getmtime(path)
+
+    # downloaded into memory, there is no file in between
+    data = downloader.download(url.toString(QUrl.ComponentFormattingOption.FullyEncoded))
+    return url.path(), data, time.time()
+
+
+def process(url: QUrl, downloader: Downloader) -> tuple[dict, QImage, bytes, dict]:
+    # everything but the store stage, runs on a pool thread
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    path, data, mtime = readUrl(url, downloader)
+    now = time.perf_counter()
+    timings["read"] = now - start
+
+    start = now
+    file_type = probeFormat(data)
+    now = time.perf_counter()
+    timings["probe"] = now - start
+    if file_type is None:
+        return None, QImage(), b"", timings
+
+    start = now
+    digest = hashlib.sha256(data).hexdigest()
+    now = time.perf_counter()
+    timings["hash"] = now - start
+
+    start = now
+    entry = {
+        "path": GraphicsItem.getBaseName(path, file_type),
+        "type": file_type,
+        "hash": digest,
+        "ctime": time.time(),
+        "mtime": mtime,
+    }
+    size = TiledGraphicsItem.readSize(data)
+    if TiledGraphicsItem.isTiled(size):
+        image = TiledGraphicsItem.readPreview(data)
+        entry["tiled"] = True
+        entry["size"] = size
+    else:
+        image = QImage.fromData(data, file_type)
+    timings["decode"] = time.perf_counter() - start
+
+    if image.isNull():
+        if size.isValid():
+            raise ValueError(f"cannot decode {size.width()}x{size.height()} {file_type} image")
+        raise ValueError(f"cannot decode {file_type} image")
+    return entry, image, data, timings
+
+
+def processImage(image: QImage) -> tuple[dict, QImage, bytes, dict]:
+    # dropped or pasted pixels, encoded once and never decoded again
+    timings = dict.fromkeys(STAGES, 0.0)
+    if image.isNull():
+        return None, QImage(), b"", timings
+
+    start = time.perf_counter()
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    data = data.data()
+    now = time.perf_counter()
+    timings["encode"] = now - start
+
+    start = now
+    digest = hashlib.sha256(data).hexdigest()
+    now = time.perf_counter()
+    timings["hash"] = now - start
+
+    entry = {
+        "path": f"{digest[:16]}.png",
+        "type": "PNG",
+        "hash": digest,
+        "ctime": time.time(),
+        "mtime": time.time(),
+    }
+    if TiledGraphicsItem.isTiled(image.size()):
+        entry["tiled"] = True
+        entry["size"] = image.size()
+        image = TiledGraphicsItem.readPreview(data)
+    return entry, image, data, timings
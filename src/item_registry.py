@@ -0,0 +1,112 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import threading
+
+from graphics_item import GraphicsItem
+
+
+class ItemRegistry:
+
+    def __init__(self) -> None:
+        self.items: dict[int, GraphicsItem] = {}
+        self.hashes: dict[str, dict[int, GraphicsItem]] = {}
+
+        # ids from next_id up have never been used, ids of images that failed
+        # to store are reused first
+        self.next_id = 0
+        self.free_ids: list[int] = []
+        # items changed since the last autosave, only touched on the GUI thread
+        self.changed: set[int] = set()
+        # deleted items keep their ids until their rows are purged by a save,
+        # ids of a running save are purging and can no longer be restored
+        self.tombstones: dict[int, GraphicsItem] = {}
+        self.purging: dict[int, GraphicsItem] = {}
+        # the drop worker allocates ids for the images it stores
+        self.lock = threading.Lock()
+
+
+    def reset(self, next_id: int) -> None:
+        with self.lock:
+            self.items.clear()
+            self.hashes.clear()
+            self.next_id = next_id
+            self.free_ids.clear()
+            self.changed.clear()
+            self.tombstones.clear()
+            self.purging.clear()
+
+
+    def allocate(self) -> int:
+        with self.lock:
+            if self.free_ids:
+                return self.free_ids.pop()
+            item_id = self.next_id
+            self.next_id += 1
+            return item_id
+
+
+    def release(self, item_id: int) -> None:
+        with self.lock:
+            self.free_ids.append(item_id)
+
+
+    def register(self, item: GraphicsItem) -> None:
+        with self.lock:
+            self.items[item.id] = item
+            self.next_id = max(self.next_id, item.id + 1)
+            if item.hash is not None:
+                self.hashes.setdefault(item.hash, {})[item.id] = item
+
+
+    def bury(self, items: list[GraphicsItem]) -> None:
+        with self.lock:
+            for item in items:
+                if self.items.pop(item.id, None) is None:
+                    continue
+                self.changed.discard(item.id)
+                self.tombstones[item.id] = item
+
+
+    def restore(self, item_ids: list[int]) -> list[GraphicsItem]:
+        items = []
+        with self.lock:
+            for item_id in item_ids:
+                item = self.tombstones.pop(item_id, None)
+                if item is None:
+                    continue
+                self.items[item_id] = item
+                items.append(item)
+        return items
+
+
+    def takeTombstones(self) -> list[int]:
+        with self.lock:
+            self.purging.update(self.tombstones)
+            self.tombstones.clear()
+            return list(self.purging)
+
+
+    def purge(self, item_ids: list[int], is_purged: bool) -> None:
+        # failed purges are retried; purged ids are not reused, commands
+        # further down the undo history may still refer to them
+        with self.lock:
+            for item_id in item_ids:
+                item = self.purging.pop(item_id, None)
+                if item is None:
+                    continue
+                if not is_purged:
+                    self.tombstones[item_id] = item
+                    continue
+                items = self.hashes.get(item.hash, {})
+                items.pop(item_id, None)
+                if not items:
+                    self.hashes.pop(item.hash, None)
+
+
+    def get(self, item_id: int) -> GraphicsItem:
+        return self.items.get(item_id)
+
+
+    def getByHash(self, digest: str) -> list[GraphicsItem]:
+        return list(self.hashes.get(digest, {}).values())
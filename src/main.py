@@ -3,6 +3,7 @@
 
 from PyQt6.QtWidgets import QApplication
 
+import system
 from main_window import MainWindow
 
 
@@ -14,7 +15,10 @@ def main():
     app.setApplicationName(name)
     app.setApplicationDisplayName(display_name)
     window = MainWindow()
-    return app.exec()
+    result = app.exec()
+    window.stopBackgroundWork()
+    system.sql.close()
+    return result
 
 
 if __name__ == "__main__":
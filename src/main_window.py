@@ -2,14 +2,17 @@
 # License: GPLv3.0
 
 import os
-import math
 import time
+import functools
+from array import array
+from collections import deque
 
 from PyQt6.QtCore import *
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 
 import system
+import commands
 from graphics_view import GraphicsView
 from graphics_item import GraphicsItem
 
@@ -24,15 +27,19 @@ class MainWindow(QMainWindow):
         system.sql = system.Database()
         system.settings = QSettings(self)
         system.undo_stack = QUndoStack(self)
-        system.undo_stack.setUndoLimit(50)
+        system.undo_stack.setUndoLimit(system.UNDO_LIMIT)
         system.undo_stack.cleanChanged.connect(self.onUndoStackCleanChanged)
+        system.item_registry = system.ItemRegistry()
+        system.z_order = system.ZOrder()
+        system.pixmap_cache = system.PixmapCache(self)
+        system.tile_loader = system.TileLoader(self)
         system.actions = system.Actions(self)
 
         system.item_load_thread = QThread()
         system.item_load_worker = system.ItemLoadWorker()
         system.item_load_worker.view = self.view
         system.item_load_worker.moveToThread(system.item_load_thread)
-        system.item_load_worker.finished.connect(system.item_load_thread.quit)
+        system.item_load_worker.finished.connect(system.item_load_thread.quit, Qt.ConnectionType.DirectConnection)
         system.item_load_worker.progress.connect(self.onItemLoadWorkerProgress)
         system.item_load_worker.finished.connect(self.onItemLoadWorkerFinished)
         system.item_load_thread.started.connect(system.item_load_worker.run)
@@ -41,11 +48,55 @@ class MainWindow(QMainWindow):
         system.item_drop_worker = system.ItemDropWorker()
         system.item_drop_worker.view = self.view
         system.item_drop_worker.moveToThread(system.item_drop_thread)
-        system.item_drop_worker.finished.connect(system.item_drop_thread.quit)
+        system.item_drop_worker.finished.connect(system.item_drop_thread.quit, Qt.ConnectionType.DirectConnection)
         system.item_drop_worker.finished.connect(self.onItemDropWorkerFinished)
         system.item_drop_worker.progress.connect(self.onItemDropWorkerProgress)
         system.item_drop_thread.started.connect(system.item_drop_worker.run)
 
+        system.mipmap_thread = QThread()
+        system.mipmap_worker = system.MipmapWorker()
+        system.mipmap_worker.moveToThread(system.mipmap_thread)
+        system.mipmap_worker.finished.connect(system.mipmap_thread.quit, Qt.ConnectionType.DirectConnection)
+        system.mipmap_worker.progress.connect(self.onMipmapWorkerProgress)
+        system.mipmap_thread.started.connect(system.mipmap_worker.run)
+
+        system.compact_thread = QThread()
+        system.compact_worker = system.CompactWorker()
+        system.compact_worker.moveToThread(system.compact_thread)
+        # direct, so wait() on the GUI thread cannot block on a queued quit
+        system.compact_worker.finished.connect(system.compact_thread.quit, Qt.ConnectionType.DirectConnection)
+        system.compact_worker.finished.connect(self.onCompactWorkerFinished)
+        system.compact_thread.started.connect(system.compact_worker.run)
+
+        system.save_thread = QThread()
+        system.save_worker = system.SaveWorker()
+        system.save_worker.moveToThread(system.save_thread)
+        system.save_worker.finished.connect(system.save_thread.quit, Qt.ConnectionType.DirectConnection)
+        system.save_worker.finished.connect(self.onSaveWorkerFinished)
+        system.save_worker.progress.connect(self.onSaveWorkerProgress)
+        system.save_thread.started.connect(system.save_worker.run)
+
+        system.autosave_thread = QThread()
+        system.autosave_worker = system.AutosaveWorker()
+        system.autosave_worker.moveToThread(system.autosave_thread)
+        system.autosave_worker.finished.connect(system.autosave_thread.quit, Qt.ConnectionType.DirectConnection)
+        system.autosave_worker.finished.connect(self.onAutosaveWorkerFinished)
+        system.autosave_thread.started.connect(system.autosave_worker.run)
+        # autosaves since the project was opened, journal entries are tagged with it
+        self.journal_generation = 0
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+
+        # items waiting to be added to the scene, inserted within a per frame budget
+        self.pending_items = deque()
+        self.pending_progress = (0, 0)
+        # drops waiting for the one before them or for a copy being saved
+        self.pending_drops = deque()
+        self.visible_loaded = 0
+        self.insert_timer = QTimer(self)
+        self.insert_timer.setInterval(int(system.FRAME_INTERVAL * 1000))
+        self.insert_timer.timeout.connect(self.insertPendingItems)
+
         self.progress_bar = QProgressBar(self)
         self.progress_bar.setMinimum(0)
         self.progress_bar.setValue(0)
@@ -80,64 +131,229 @@ class MainWindow(QMainWindow):
         is_filtering = system.settings.value("filtering", True, type=bool)
         system.actions.filtering.setChecked(is_filtering)
         self.setFiltering(is_filtering)
-
-        # project
+        system.batch_size = system.settings.value("batch_size", system.DEFAULT_BATCH_SIZE, type=int)
+        system.frame_budget = system.settings.value("frame_budget", system.DEFAULT_FRAME_BUDGET, type=int)
+        system.pixmap_cache.budget = system.settings.value("pixmap_budget", system.DEFAULT_PIXMAP_BUDGET, type=int)
+        system.autosave_interval = system.settings.value("autosave_interval", system.DEFAULT_AUTOSAVE_INTERVAL, type=int)
+        if system.autosave_interval > 0:
+            self.autosave_timer.start(system.autosave_interval * 1000)
+
+        # project, an unsaved one is kept in memory until saved
         if os.path.isfile(file_path):
             system.sql.file_path = file_path
-            system.sql.createDatabase()
+        system.sql.createDatabase()
+        if system.sql.file_path != "":
+            self.recoverJournal()
             self.view.load()
 
 
     def loadFile(self, file_path: str):
+        self.stopBackgroundWork()
+        self.pending_items.clear()
+        system.actions.cancel_import.setEnabled(False)
+        self.visible_loaded = 0
+        system.pixmap_cache.clear()
         self.scene.clear()
         self.view.resetTransform()
+        system.sql.close()
         system.sql.file_path = file_path
         system.sql.createDatabase()
         system.undo_stack.clear()
         system.undo_stack.resetClean()
         system.settings.setValue("file_path", file_path)
+        self.journal_generation = 0
+        self.recoverJournal()
         self.view.load()
 
 
-    def save(self):
-        # settings
-        system.settings.setValue("geometry", self.geometry())
+    def save(self) -> bool:
+        # whether a save was started, the project is unsaved otherwise
+        if system.sql.file_path == "":
+            return self.saveAs()
+
+        self.startSave("")
+        return True
+
+
+    def saveAs(self) -> bool:
         default_file_path = os.path.join(system.DEFAULT_FILE_DIR, system.DEFAULT_FILE_NAME)
-        file_path = default_file_path
+        if system.sql.file_path != "":
+            default_file_path = system.sql.file_path
 
-        # project
-        if system.sql.file_path == "":
-            file_path, _selected_filter = QFileDialog().getSaveFileName(
+        file_path, _selected_filter = QFileDialog().getSaveFileName(
+            self,
+            "Save Project As",
+            default_file_path,
+            system.PROJECT_FILTER
+        )
+
+        if not file_path:
+            return False
+
+        system.last_dialog_dir, _ = os.path.split(file_path)
+        if file_path == system.sql.file_path:
+            self.startSave("")
+            return True
+
+        # images stored meanwhile would be missing from the copy
+        if system.item_drop_thread.isRunning() or system.item_load_thread.isRunning():
+            QMessageBox().information(
                 self,
-                "Save Project",
-                default_file_path,
-                system.PROJECT_FILTER
+                "Save Project As",
+                "Images are still being added.\nSave the project as a new file once they are done."
             )
+            return False
+
+        self.startSave(file_path)
+        return True
+
+
+    def startSave(self, target: str) -> None:
+        # one save at a time, the next one picks up what changed meanwhile
+        system.save_thread.wait()
+        # a journal write still running would land after the snapshot
+        system.autosave_thread.wait()
+
+        if target:
+            # writes from other connections restart the copy
+            system.mipmap_worker.cancelled = True
+            system.mipmap_thread.wait()
+            system.compact_thread.wait()
+            for path in (target, target + "-wal", target + "-shm"):
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.progress_bar.setMaximum(0)
+            self.progress_bar.show()
+
+        system.save_worker.snapshot = {
+            "view": system.sql.getViewState(self.view),
+            "updates": system.sql.getItemUpdates(self.scene.items()),
+            "generation": self.journal_generation,
+            "deleted": system.item_registry.takeTombstones(),
+            "source": system.sql.file_path,
+            "target": target,
+        }
+        system.item_registry.changed.clear()
+        system.save_thread.start()
+        system.actions.save.setEnabled(False)
+        system.actions.save_as.setEnabled(False)
+        self.setWindowTitle("Saving[*]")
 
-            if file_path:
-                system.last_dialog_dir, _ = os.path.split(file_path)
-                system.sql.file_path = file_path
-                system.sql.createDatabase()
-                system.sql.updateView(self.view)
-                items = self.scene.items()
-                for item in items:
-                    system.sql.storeItem(item)
-            else:
-                return
-        else:
-            file_path = system.sql.file_path
-            items = self.scene.items()
-            system.sql.updateView(self.view)
-            system.sql.updateItems(items)
-
-        system.settings.setValue("file_path", file_path)
+        # settings
+        system.settings.setValue("geometry", self.geometry())
         system.settings.setValue("last_dir", system.last_dialog_dir)
         system.settings.setValue("grayscale", system.actions.grayscale.isChecked())
         system.settings.setValue("filtering", system.actions.filtering.isChecked())
+        system.settings.setValue("batch_size", system.batch_size)
+        system.settings.setValue("frame_budget", system.frame_budget)
+        system.settings.setValue("pixmap_budget", system.pixmap_cache.budget)
+        system.settings.setValue("autosave_interval", system.autosave_interval)
 
         system.undo_stack.setClean()
 
 
+    def stopBackgroundWork(self) -> None:
+        # every thread using the project is done before its connections are closed
+        system.item_load_worker.cancel()
+        system.item_load_thread.wait()
+        system.item_load_worker.pool.waitForDone()
+        self.pending_drops.clear()
+        system.item_drop_worker.cancel()
+        # what it stored belongs to the closed project
+        system.item_drop_worker.generation += 1
+        system.item_drop_thread.wait()
+        system.mipmap_worker.cancelled = True
+        system.mipmap_thread.wait()
+        system.compact_thread.wait()
+        system.save_thread.wait()
+        system.autosave_thread.wait()
+        system.pixmap_cache.pool.waitForDone()
+        system.tile_loader.clear()
+
+
+    def autosave(self) -> None:
+        # only items changed since the previous autosave are written
+        if system.sql.file_path == "" or system.autosave_thread.isRunning():
+            return
+        # a journal write would restart the copy, the changes stay for the next autosave
+        if system.save_thread.isRunning() and system.save_worker.snapshot["target"]:
+            return
+        if not system.item_registry.changed:
+            return
+
+        rows = []
+        for item_id in system.item_registry.changed:
+            state = system.item_registry.get(item_id).getState()
+            rows.append([item_id, state["x"], state["y"], state["z"],
+                state["rotation"], state["scale"], state["flip"]])
+        system.item_registry.changed.clear()
+
+        self.journal_generation += 1
+        system.autosave_worker.generation = self.journal_generation
+        system.autosave_worker.rows = rows
+        system.autosave_thread.start(QThread.Priority.LowPriority)
+
+
+    def recoverJournal(self) -> None:
+        count = system.sql.countJournal()
+        if count == 0:
+            return
+
+        result = QMessageBox().question(
+            self,
+            "Recover Changes",
+            f"The project has {count} autosaved changes that were never saved.\nDo you want to recover them?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.Yes
+        )
+
+        if result == QMessageBox.StandardButton.Yes:
+            system.sql.replayJournal()
+        else:
+            system.sql.clearJournal()
+
+
+    def discardJournal(self) -> None:
+        if system.sql.file_path == "":
+            return
+
+        system.autosave_thread.wait()
+        system.sql.clearJournal()
+
+
+    def startMipmaps(self) -> None:
+        if system.mipmap_thread.isRunning():
+            return
+        # a full compaction holds the write lock, mipmaps start once it is done
+        if system.compact_thread.isRunning() and system.compact_worker.full:
+            return
+
+        system.mipmap_thread.start(QThread.Priority.LowPriority)
+
+
+    def startCompaction(self, full: bool) -> None:
+        if system.sql.file_path == "":
+            return
+        if system.compact_thread.isRunning():
+            return
+
+        system.compact_worker.full = full
+        system.compact_thread.start()
+
+
+    def compactProject(self) -> None:
+        if system.sql.file_path == "":
+            return
+
+        self.progress_bar.setMaximum(0)
+        self.progress_bar.show()
+        system.compact_thread.wait()
+        # its writes would wait on the write lock and fail
+        system.mipmap_worker.cancelled = True
+        system.mipmap_thread.wait()
+        self.startCompaction(True)
+
+
     def open(self):
         file_path, _selected_filter = QFileDialog().getOpenFileName(
             self,
@@ -155,9 +371,10 @@ class MainWindow(QMainWindow):
         if self.isWindowModified():
             result = self.notifyUnsavedChanges()
             if result == QMessageBox.StandardButton.Save:
-                self.save()
+                if not self.save():
+                    return
             elif result == QMessageBox.StandardButton.Discard:
-                pass
+                self.discardJournal()
             elif result == QMessageBox.StandardButton.Cancel:
                 return
             else:
@@ -206,9 +423,12 @@ class MainWindow(QMainWindow):
         if self.isWindowModified():
             result = self.notifyUnsavedChanges()
             if result == QMessageBox.StandardButton.Save:
-                self.save()
-                event.accept()
+                if self.save():
+                    event.accept()
+                else:
+                    event.ignore()
             elif result == QMessageBox.StandardButton.Discard:
+                self.discardJournal()
                 event.accept()
             elif result == QMessageBox.StandardButton.Cancel:
                 event.ignore()
@@ -230,8 +450,10 @@ class MainWindow(QMainWindow):
 
     def flipSelection(self) -> None:
         items = self.scene.selectedItems()
-        for item in items:
-            item.flip()
+        if not len(items) > 0:
+            return
+
+        system.undo_stack.push(commands.Flip(items))
 
 
     def setGrayscale(self, state: bool) -> None:
@@ -239,10 +461,15 @@ class MainWindow(QMainWindow):
 
 
     def selectAll(self) -> None:
-        self.scene.clearSelection()
-        items = self.scene.items()
-        for item in items:
-            item.setSelected(True)
+        self.view.selectAll()
+
+
+    def invertSelection(self) -> None:
+        self.view.invertSelection()
+
+
+    def clearSelection(self) -> None:
+        self.view.clearSelection()
 
 
     def setFiltering(self, state: bool) -> None:
@@ -258,7 +485,10 @@ class MainWindow(QMainWindow):
 
 
     def packSelection(self) -> None:
+        items = self.scene.selectedItems()
+        before = commands.Transform.capture(items)
         self.view.packSelection()
+        self.pushTransform("Pack", items, before)
 
 
     def deleteSelection(self) -> None:
@@ -266,9 +496,8 @@ class MainWindow(QMainWindow):
         if not len(items) > 0:
             return
 
-        for item in items:
-            system.sql.deleteItem(item)
-            self.scene.removeItem(item)
+        # rows are purged by the next save
+        system.undo_stack.push(commands.Delete(self.scene, items))
 
 
     def onUndoStackCleanChanged(self, state: bool) -> None:
@@ -277,23 +506,18 @@ class MainWindow(QMainWindow):
 
     def resetSelectionTransforms(self) -> None:
         items = self.scene.selectedItems()
-        if not len(items) > 0:
-            return
+        before = commands.Transform.capture(items)
+        self.view.resetSelectionTransforms()
+        self.pushTransform("Reset Transform", items, before)
 
-        for item in items:
-            scale = item.scale() * 1.0/item.scale()
-            item.setScale(scale)
 
-            group = self.scene.createItemGroup([item])
-            center = group.boundingRect().center()
-            group.setTransformOriginPoint(center)
-            rotation = math.degrees(item.getRotation())
-            group.setRotation(0.0 - rotation)
-            self.scene.destroyItemGroup(group)
+    def pushTransform(self, text: str, items: list[GraphicsItem], before: array) -> None:
+        command = commands.Transform(text, items, before)
+        if command.isChanged():
+            system.undo_stack.push(command)
 
 
     def importImages(self) -> None:
-        # todo: thread
         image_filter = "Images (*.png *.jpg *.jpeg)"
         file_paths, _selected_filter = QFileDialog().getOpenFileNames(
             self,
@@ -303,21 +527,72 @@ class MainWindow(QMainWindow):
         )
 
         if len(file_paths) > 0:
-            pos = QPointF(system.actions.menu.pos())
             path, _ = os.path.split(file_paths[0])
             system.last_dialog_dir = path
+            urls = [QUrl.fromLocalFile(file_path) for file_path in file_paths]
+            self.ingestUrls(urls, self.getMenuPos())
+
+
+    def importFolder(self) -> None:
+        directory = QFileDialog().getExistingDirectory(
+            self,
+            "Import Folder",
+            system.last_dialog_dir
+        )
+
+        if directory:
+            system.last_dialog_dir = directory
+            self.ingestUrls([QUrl.fromLocalFile(directory)], self.getMenuPos())
+
+
+    def getMenuPos(self) -> QPointF:
+        pos = self.view.mapFromGlobal(system.actions.menu.pos())
+        return self.view.mapToScene(pos)
+
+
+    def ingestUrls(self, urls: list[QUrl], pos: QPointF, images: list[QImage] = None) -> None:
+        # files, folders and in-memory images are read, decoded and stored on the drop worker
+        self.pending_drops.append((urls, pos, images or []))
+        self.startPendingDrop()
 
-            self.scene.clearSelection()
-            item_count = 0
-            for file_path in file_paths:
-                item = self.view.addItem(path=file_path, pos=pos)
-                if item:
-                    item.setSelected(True)
-                    self.scene.addItem(item)
-                    item_count += 1
 
-            if item_count > 1:
-                self.packSelection()
+    def startPendingDrop(self) -> None:
+        # one drop at a time, and none while the copy being saved would miss it
+        if not self.pending_drops or system.item_drop_thread.isRunning():
+            return
+        if system.save_thread.isRunning() and system.save_worker.snapshot["target"]:
+            return
+
+        urls, pos, images = self.pending_drops.popleft()
+        system.item_drop_worker.urls = urls
+        system.item_drop_worker.images = images
+        system.item_drop_worker.pos = pos
+        system.item_drop_worker.cancelled = False
+        system.item_drop_worker.downloader.cancelled = False
+        system.item_drop_thread.start()
+        system.actions.cancel_import.setEnabled(True)
+        self.progress_bar.setMaximum(0)
+        self.progress_bar.show()
+
+
+    def paste(self) -> None:
+        mimedata = QApplication.clipboard().mimeData()
+        pos = self.view.mapFromGlobal(QCursor.pos())
+        if not self.view.viewport().rect().contains(pos):
+            pos = self.view.viewport().rect().center()
+        pos = self.view.mapToScene(pos)
+
+        # copied files are read as they are, keeping their name and encoding
+        is_local = any(url.isLocalFile() for url in mimedata.urls())
+        if mimedata.hasImage() and not is_local:
+            self.ingestUrls([], pos, [QApplication.clipboard().image()])
+        elif mimedata.hasUrls():
+            self.ingestUrls(mimedata.urls(), pos)
+
+
+    def cancelImport(self) -> None:
+        self.pending_drops.clear()
+        system.item_drop_worker.cancel()
 
 
     def exportImages(self) -> None:
@@ -347,7 +622,7 @@ class MainWindow(QMainWindow):
             file_name = os.path.join(directory, new_name)
 
             with open(file_name, "wb") as fp:
-                data = system.sql.getImage(item)
+                data = system.sql.getImage(item.id)
                 fp.write(data)
 
             atime = time.time()
@@ -355,28 +630,195 @@ class MainWindow(QMainWindow):
             os.utime(file_name, (atime, mtime))
 
 
-    def onItemLoadWorkerProgress(self, item: GraphicsItem, value: int, total: int) -> None:
-        self.scene.addItem(item)
+    def onMipmapWorkerProgress(self, batch: list) -> None:
+        # mipmaps belong to blobs, every item showing one gets them
+        for digest, levels in batch:
+            system.pixmap_cache.setMipmaps(digest, levels)
+
+
+    def onCompactWorkerFinished(self, reclaimed: int, full: bool, is_compacted: bool) -> None:
+        if not full:
+            return
+
+        self.progress_bar.hide()
+        system.compact_thread.wait()
+        self.startMipmaps()
+        if not is_compacted:
+            QMessageBox().warning(
+                self,
+                "Compact Project",
+                "The project could not be compacted."
+            )
+            return
+
+        size = QLocale().formattedDataSize(max(reclaimed, 0))
+        QMessageBox().information(
+            self,
+            "Compact Project",
+            f"Reclaimed {size}."
+        )
+
+
+    def onSaveWorkerProgress(self, value: int, total: int) -> None:
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(value)
-        self.view.update()
 
 
-    def onItemLoadWorkerFinished(self) -> None:
-        self.progress_bar.hide()
+    def onSaveWorkerFinished(self, written: int, is_saved: bool, snapshot: dict) -> None:
+        source = snapshot["source"]
+        target = snapshot["target"]
+        # a later save may already be running with a newer snapshot
+        if not system.save_thread.isRunning():
+            system.actions.save.setEnabled(True)
+            system.actions.save_as.setEnabled(True)
+            self.setWindowTitle("[*]")
+        if target:
+            self.progress_bar.hide()
+        if target and system.save_worker.snapshot is snapshot:
+            # drops waiting for the copy start once the thread has ended
+            system.save_thread.wait()
+        system.item_registry.purge(snapshot["deleted"], is_saved)
+        if not is_saved:
+            # written again by the next save
+            for columns, rows in snapshot["updates"].items():
+                for row in rows:
+                    item = system.item_registry.get(row[-1])
+                    if item is not None:
+                        item.markDirty(*columns)
+            system.undo_stack.resetClean()
+            self.setWindowModified(True)
+            QMessageBox().warning(
+                self,
+                "Save Project",
+                "The project could not be saved."
+            )
+            self.startPendingDrop()
+            return
+
+        # another project may have been opened while copying
+        if target and system.sql.file_path == source:
+            system.pixmap_cache.pool.waitForDone()
+            system.tile_loader.pool.waitForDone()
+            # also frees the in-memory database of an unsaved project
+            system.sql.close()
+            system.sql.file_path = target
+        # only a saved file is opened on the next launch
+        system.settings.setValue("file_path", system.sql.file_path)
 
-    
-    def onItemDropWorkerProgress(self, item: GraphicsItem, value: int, total: int) -> None:
-        self.scene.addItem(item)
+        self.startMipmaps()
+        self.startCompaction(False)
+        self.startPendingDrop()
+
+
+    def onAutosaveWorkerFinished(self, written: int, is_saved: bool, rows: list) -> None:
+        if is_saved:
+            return
+
+        # journaled again by the next autosave
+        for row in rows:
+            if system.item_registry.get(row[0]) is not None:
+                system.item_registry.changed.add(row[0])
+
+
+    def queueItems(self, entries: list, value: int, total: int) -> None:
+        self.pending_items.extend(entries)
+        self.pending_progress = (value, total)
+        if not self.insert_timer.isActive():
+            self.insert_timer.start()
+
+
+    def insertPendingItems(self) -> None:
+        # one repaint per frame however many items are added
+        deadline = time.perf_counter() + system.frame_budget / 1000.0
+        while self.pending_items and time.perf_counter() < deadline:
+            pending = self.pending_items.popleft()
+            if isinstance(pending, tuple):
+                entry, image = pending
+                pos = QPointF(entry["x"], entry["y"])
+                item_class = system.TiledGraphicsItem if entry.get("tiled") else GraphicsItem
+                pixmap = system.pixmap_cache.getPixmap(entry.get("hash"))
+                item = item_class(pos=pos, drop=False, image=image, pixmap=pixmap, **entry)
+                item.setTransformationMode(self.view.transformation_mode)
+                self.scene.addItem(item)
+                system.pixmap_cache.add(item)
+                system.pixmap_cache.setMipmaps(item.hash, entry.get("mipmaps"))
+                if entry.get("visible"):
+                    self.onVisibleItemLoaded()
+            else:
+                pending()
+
+        value, total = self.pending_progress
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(value)
-        self.view.update()
+
+        # not restarted every frame, the budget is enforced while loading
+        if not self.view.cache_timer.isActive():
+            self.view.cache_timer.start()
+        if not self.pending_items:
+            self.insert_timer.stop()
+
+
+    def onVisibleItemLoaded(self) -> None:
+        self.visible_loaded += 1
+        visible_total = system.item_load_worker.visible_total
+        if self.visible_loaded == visible_total:
+            elapsed = time.perf_counter() - system.item_load_worker.start_time
+            print(f"first frame after {elapsed:.2f}s ({visible_total} visible images)")
 
 
-    def onItemDropWorkerFinished(self, result: int, items: list) -> None:
+    def onItemLoadWorkerProgress(self, entries: list, value: int, total: int, generation: int) -> None:
+        if generation != system.item_load_worker.generation:
+            return
+        self.queueItems(entries, value, total)
+
+
+    def onItemLoadWorkerFinished(self, generation: int) -> None:
+        if generation != system.item_load_worker.generation:
+            return
+        self.queueItems([self.finishLoad], *self.pending_progress)
+
+
+    def finishLoad(self) -> None:
+        self.progress_bar.hide()
+        self.startMipmaps()
+        total = system.item_load_worker.total
+        elapsed = time.perf_counter() - system.item_load_worker.start_time
+        if total > 0:
+            print(f"loaded {total} images in {elapsed:.2f}s ({total / elapsed:.1f} images/s)")
+
+
+    def onItemDropWorkerProgress(self, items: list, value: int, total: int, generation: int) -> None:
+        if generation != system.item_drop_worker.generation:
+            return
+        self.queueItems(items, value, total)
+
+
+    def onItemDropWorkerFinished(self, result: int, item_ids: list, failed: list, generation: int) -> None:
+        if generation != system.item_drop_worker.generation:
+            return
+        self.queueItems([functools.partial(self.finishDrop, item_ids, failed, generation)], *self.pending_progress)
+
+
+    def finishDrop(self, item_ids: list, failed: list, generation: int) -> None:
+        if generation != system.item_drop_worker.generation:
+            return
+        # items are created from the worker results on this thread
+        items = [system.item_registry.get(item_id) for item_id in item_ids]
+        items = [item for item in items if item]
         if len(items) > 1:
-            self.view.scene().clearSelection()
-            for item in items:
-                item.setSelected(True)
+            self.view.setSelection(items, clear=True)
             self.view.packSelection()
         self.progress_bar.hide()
+        system.actions.cancel_import.setEnabled(False)
+        self.startMipmaps()
+        system.item_drop_thread.wait()
+        self.startPendingDrop()
+        if len(failed) > 0:
+            shown = "\n".join(failed[:10])
+            if len(failed) > 10:
+                shown += f"\n...and {len(failed) - 10} more"
+            QMessageBox().warning(
+                self,
+                "Import Failed",
+                f"{len(failed)} files could not be added:\n{shown}"
+            )
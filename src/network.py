@@ -0,0 +1,137 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import ssl
+import threading
+import http.client
+import urllib.parse
+
+import system
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Downloader:
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        # idle keep-alive connections by scheme, host and port
+        self.idle: dict[tuple, list[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(system.MAX_DOWNLOADS)
+        self.context = ssl.create_default_context()
+
+
+    def download(self, url: str) -> bytes:
+        # runs on pool threads, at most MAX_DOWNLOADS at once
+        self.checkCancelled()
+        with self.slots:
+            for _redirect in range(MAX_REDIRECTS):
+                location, data = self.request(url)
+                if location is None:
+                    return data
+                url = urllib.parse.urljoin(url, location)
+        raise DownloadError(f"too many redirects: {url}")
+
+
+    def request(self, url: str) -> tuple[str, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise DownloadError(f"unsupported url: {url}")
+
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = {"User-Agent": "riv", "Accept": "image/*"}
+
+        # a kept-alive connection may have been closed by the server meanwhile
+        for attempt in range(2):
+            self.checkCancelled()
+            connection, reused = self.acquire(key)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+
+            try:
+                location = None
+                data = b""
+                if response.status in REDIRECTS:
+                    location = response.getheader("Location")
+                    response.read()
+                elif response.status == 200:
+                    data = self.read(response)
+                else:
+                    raise DownloadError(f"{response.status} {response.reason}: {url}")
+            except BaseException:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(key, connection)
+            return location, data
+
+
+    def read(self, response: http.client.HTTPResponse) -> bytes:
+        length = response.getheader("Content-Length")
+        if length and int(length) > system.DOWNLOAD_MAX_SIZE:
+            raise DownloadError(f"larger than {system.DOWNLOAD_MAX_SIZE} bytes")
+
+        data = bytearray()
+        while True:
+            self.checkCancelled()
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > system.DOWNLOAD_MAX_SIZE:
+                raise DownloadError(f"larger than {system.DOWNLOAD_MAX_SIZE} bytes")
+        return bytes(data)
+
+
+    def checkCancelled(self) -> None:
+        # checked before anything that may wait on the network
+        if self.cancelled:
+            raise DownloadError("cancelled")
+
+
+    def acquire(self, key: tuple) -> tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port,
+                timeout=system.DOWNLOAD_TIMEOUT, context=self.context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=system.DOWNLOAD_TIMEOUT)
+        return connection, False
+
+
+    def release(self, key: tuple, connection: http.client.HTTPConnection) -> None:
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+
+    def close(self) -> None:
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
@@ -0,0 +1,190 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import functools
+from collections import OrderedDict
+
+from PyQt6.QtCore import *
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+
+import system
+from graphics_item import GraphicsItem
+from tiled_graphics_item import TiledGraphicsItem
+
+
+class PixmapCache(QObject):
+
+    loaded = pyqtSignal(str, int, QImage, object)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        # megabytes of full resolution pixmaps, used is counted in pixels
+        self.budget = system.DEFAULT_PIXMAP_BUDGET
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # by blob hash, least recently visible first
+        # items showing the same blob share one pixmap and are counted once
+        self.items: OrderedDict[str, list[GraphicsItem]] = OrderedDict()
+        self.requested: dict[str, list[GraphicsItem]] = {}
+        # by blob hash, mipmap levels shared by all items showing the blob;
+        # levels above the smallest are kept and counted with the full pixmap
+        self.mipmaps: dict[str, dict[int, QPixmap]] = {}
+        self.generation = 0
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.pool.setExpiryTimeout(-1)
+        self.loaded.connect(self.onLoaded)
+
+
+    def add(self, item: GraphicsItem) -> None:
+        # tiled items only hold a preview and bound their own tiles
+        if isinstance(item, TiledGraphicsItem):
+            return
+        if item.pixmap().isNull():
+            return
+
+        items = self.items.get(item.hash)
+        if items is None:
+            self.items[item.hash] = [item]
+            self.used += self.getSize(item) + self.getMipmapSize(item.hash)
+        elif item not in items:
+            items.append(item)
+
+
+    def remove(self, item: GraphicsItem) -> None:
+        requested = self.requested.get(item.hash, [])
+        if item in requested:
+            requested.remove(item)
+
+        items = self.items.get(item.hash, [])
+        if item in items:
+            items.remove(item)
+            if not items:
+                del self.items[item.hash]
+                self.used -= self.getSize(item) + self.getMipmapSize(item.hash)
+
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.requested.clear()
+        self.mipmaps.clear()
+        self.used = 0
+        self.generation += 1
+
+
+    def getPixmap(self, digest: str) -> QPixmap:
+        items = self.items.get(digest)
+        if not items:
+            return None
+        return items[0].pixmap()
+
+
+    def getMipmaps(self, digest: str) -> dict[int, QPixmap]:
+        return self.mipmaps.setdefault(digest, {})
+
+
+    def setMipmaps(self, digest: str, images: dict[int, QImage]) -> None:
+        # changed in place, every item showing the blob holds the same levels
+        levels = self.getMipmaps(digest)
+        if not images or images.keys() <= levels.keys():
+            return
+
+        if digest in self.items:
+            self.used -= self.getMipmapSize(digest)
+        levels.clear()
+        for level, image in images.items():
+            levels[level] = QPixmap.fromImage(image)
+        if digest in self.items:
+            self.used += self.getMipmapSize(digest)
+        else:
+            self.trimMipmaps(digest)
+
+        for item in system.item_registry.getByHash(digest):
+            item.update()
+
+
+    def trimMipmaps(self, digest: str) -> None:
+        levels = self.mipmaps.get(digest, {})
+        for level in sorted(levels)[:-1]:
+            del levels[level]
+
+
+    def update(self, visible_items: list[GraphicsItem]) -> None:
+        visible_hashes = set()
+        for item in visible_items:
+            if not isinstance(item, GraphicsItem):
+                continue
+            visible_hashes.add(item.hash)
+            if item.pixmap().isNull():
+                pixmap = self.getPixmap(item.hash)
+                if pixmap is None:
+                    self.misses += 1
+                    self.request(item)
+                    continue
+                item.setPixmap(pixmap)
+                self.add(item)
+            if item.hash in self.items:
+                self.hits += 1
+                self.items.move_to_end(item.hash)
+
+        budget = self.budget * 1024 * 1024 // 4
+        for digest in list(self.items):
+            if self.used <= budget:
+                break
+            if digest in visible_hashes:
+                continue
+            items = self.items.pop(digest)
+            self.used -= self.getSize(items[0]) + self.getMipmapSize(digest)
+            self.trimMipmaps(digest)
+            self.evictions += 1
+            for item in items:
+                item.unloadPixmap()
+
+
+    def request(self, item: GraphicsItem) -> None:
+        requested = self.requested.get(item.hash)
+        if requested is not None:
+            if item not in requested:
+                requested.append(item)
+            return
+
+        self.requested[item.hash] = [item]
+        self.pool.start(functools.partial(self.decode, item.hash, self.generation))
+
+
+    def decode(self, digest: str, generation: int) -> None:
+        # runs on the pool
+        image = QImage.fromData(system.sql.getBlob(digest))
+        mipmaps = {}
+        for level, level_data in system.sql.loadMipmaps(digest):
+            mipmaps[level] = QImage.fromData(level_data)
+        self.loaded.emit(digest, generation, image, mipmaps)
+
+
+    def onLoaded(self, digest: str, generation: int, image: QImage, mipmaps: dict) -> None:
+        if generation != self.generation:
+            return
+
+        items = self.requested.pop(digest, None)
+        if not items:
+            return
+
+        pixmap = QPixmap.fromImage(image)
+        for item in items:
+            item.setPixmap(pixmap)
+            self.add(item)
+        self.setMipmaps(digest, mipmaps)
+
+
+    def getSize(self, item: GraphicsItem) -> int:
+        return int(item.image_size.width() * item.image_size.height())
+
+
+    def getMipmapSize(self, digest: str) -> int:
+        levels = self.mipmaps.get(digest, {})
+        return sum(levels[level].width() * levels[level].height() for level in sorted(levels)[:-1])
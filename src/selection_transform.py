@@ -0,0 +1,96 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import math
+from array import array
+
+from PyQt6.QtCore import *
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+
+import commands
+from graphics_item import GraphicsItem
+
+
+class SelectionTransform:
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.items: list[GraphicsItem] = []
+        self.pivot = QPointF()
+        # state of every item when the interaction started, see Transform.capture
+        self.before = array("d")
+
+
+    def isActive(self) -> bool:
+        return len(self.items) > 0
+
+
+    @staticmethod
+    def getPivot(items: list[GraphicsItem]) -> QPointF:
+        rect = QRectF()
+        for item in items:
+            rect = rect.united(item.sceneBoundingRect())
+        return rect.center()
+
+
+    def begin(self, text: str, items: list[GraphicsItem]) -> None:
+        # the pivot is computed once, moves only apply the matrix math;
+        # change notifications are off while moving, dirty is marked at the end
+        self.text = text
+        self.before = commands.Transform.capture(items)
+        for item in items:
+            item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges, False)
+        self.items = items
+        self.pivot = SelectionTransform.getPivot(items)
+
+
+    def end(self) -> commands.Transform:
+        for item in self.items:
+            item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges, True)
+            item.markDirty("x", "y", "rotation", "scale")
+        command = commands.Transform(self.text, self.items, self.before)
+        self.items = []
+        self.before = array("d")
+        if not command.isChanged():
+            return None
+        return command
+
+
+    def rotate(self, angle: float) -> None:
+        # degrees from the start of the interaction
+        radians = math.radians(angle)
+        cos = math.cos(radians)
+        sin = math.sin(radians)
+        px = self.pivot.x()
+        py = self.pivot.y()
+        states = self.before
+        for i, item in enumerate(self.items):
+            j = i * commands.STATE_SIZE
+            dx = states[j] - px
+            dy = states[j + 1] - py
+            item.setPos(px + dx * cos - dy * sin, py + dx * sin + dy * cos)
+            item.setRotation(states[j + 2] + angle)
+
+
+    def scale(self, factor: float) -> None:
+        # factor from the start of the interaction
+        px = self.pivot.x()
+        py = self.pivot.y()
+        states = self.before
+        for i, item in enumerate(self.items):
+            j = i * commands.STATE_SIZE
+            item.setPos(px + (states[j] - px) * factor, py + (states[j + 1] - py) * factor)
+            item.setScale(states[j + 3] * factor)
+
+
+    @staticmethod
+    def reset(items: list[GraphicsItem]) -> None:
+        # each item keeps its center in place
+        for item in items:
+            center = item.sceneBoundingRect().center()
+            item.setTransform(QTransform())
+            item.setTransformOriginPoint(QPointF())
+            item.setRotation(0.0)
+            item.setScale(1.0)
+            item.setPos(center - item.boundingRect().center())
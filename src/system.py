@@ -5,8 +5,13 @@ from PyQt6.QtCore import *
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 
-from database import (Database, ItemLoadWorker, ItemDropWorker)
+from database import (Database, ItemLoadWorker, ItemDropWorker, MipmapWorker, CompactWorker,
+    SaveWorker, AutosaveWorker)
 from actions import Actions
+from pixmap_cache import PixmapCache
+from tiled_graphics_item import (TiledGraphicsItem, TileLoader)
+from item_registry import ItemRegistry
+from z_order import ZOrder
 
 
 DEFAULT_FILE_DIR = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
@@ -14,10 +19,68 @@ DEFAULT_FILE_NAME = "untitled.riv"
 PROJECT_FILTER = "RIV (*.riv)"
 last_dialog_dir = DEFAULT_FILE_DIR
 
+# background compaction starts above this free page ratio
+COMPACT_FREE_RATIO = 0.1
+COMPACT_STEP_PAGES = 256
+
+# seconds, workers emit what is ready at least this often
+FRAME_INTERVAL = 1.0 / 60.0
+DEFAULT_BATCH_SIZE = 32
+# milliseconds spent inserting items per frame
+DEFAULT_FRAME_BUDGET = 8
+batch_size = DEFAULT_BATCH_SIZE
+frame_budget = DEFAULT_FRAME_BUDGET
+
+# unsaved projects live in an in-memory database shared by all threads
+MEMORY_DATABASE = "file:/riv-unsaved?vfs=memdb"
+# pages copied per step when saving a project to a new file
+BACKUP_STEP_PAGES = 1024
+
+# image data written per transaction when storing many images
+STORE_TRANSACTION_BYTES = 64 * 1024 * 1024
+STORE_TRANSACTION_ROWS = 256
+
+# web images dropped at once are downloaded this many at a time
+MAX_DOWNLOADS = 4
+# seconds without data before a download fails
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_MAX_SIZE = 256 * 1024 * 1024
+
+# seconds between autosaves of changed items to the journal, 0 disables them
+DEFAULT_AUTOSAVE_INTERVAL = 60
+autosave_interval = DEFAULT_AUTOSAVE_INTERVAL
+
+# undo steps kept, commands only hold ids and transform values
+UNDO_LIMIT = 5000
+# seconds within which repeated moves or transforms of the same items merge
+UNDO_MERGE_INTERVAL = 1.0
+
+# z values are packed again from 0 when raising would pass this
+Z_ORDER_LIMIT = 2 ** 24
+
+# smallest side in pixels of the last mipmap level
+MIPMAP_MIN_SIZE = 128
+
+# megabytes of full resolution pixmaps kept in memory
+DEFAULT_PIXMAP_BUDGET = 2048
+
+# images above this many pixels are drawn from tiles decoded on demand
+TILED_IMAGE_PIXELS = 32 * 1024 * 1024
+TILE_SIZE = 512
+# tiles kept per item
+TILE_CACHE_SIZE = 64
+# megabytes one decode may allocate; formats like PNG and TIFF cannot decode
+# part of an image, their tiles are cut from one decoded copy at a time
+DECODE_ALLOCATION_LIMIT = 2048
+
 sql: Database = None
 settings: QSettings = None
 actions: Actions = None
 undo_stack: QUndoStack = None
+pixmap_cache: PixmapCache = None
+tile_loader: TileLoader = None
+item_registry: ItemRegistry = None
+z_order: ZOrder = None
 
 item_load_thread: QThread = None
 item_load_worker: ItemLoadWorker = None
@@ -25,11 +88,14 @@ item_load_worker: ItemLoadWorker = None
 item_drop_thread: QThread = None
 item_drop_worker: ItemDropWorker = None
 
-item_ids: list[int] = []
+mipmap_thread: QThread = None
+mipmap_worker: MipmapWorker = None
+
+compact_thread: QThread = None
+compact_worker: CompactWorker = None
+
+save_thread: QThread = None
+save_worker: SaveWorker = None
 
-def getItemID() -> int:
-    i = 0
-    while i in item_ids:
-        i += 1
-    item_ids.append(i)
-    return i
+autosave_thread: QThread = None
+autosave_worker: AutosaveWorker = None
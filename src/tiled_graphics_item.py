@@ -0,0 +1,214 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import math
+import threading
+import functools
+from collections import OrderedDict
+
+from PyQt6 import sip
+from PyQt6.QtCore import *
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+
+import system
+from graphics_item import GraphicsItem
+
+
+class TiledGraphicsItem(GraphicsItem):
+
+    def __init__(self, **kwargs: dict) -> None:
+        super().__init__(**kwargs)
+        # tiles are decoded on demand from the stored image, see TileLoader
+        self.tiles: OrderedDict[tuple, QPixmap] = OrderedDict()
+        self.pending: set[tuple] = set()
+
+        self.levels = 1
+        size = max(self.image_size.width(), self.image_size.height())
+        while size / 2 ** (self.levels - 1) > system.TILE_SIZE:
+            self.levels += 1
+
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+
+    @staticmethod
+    def isTiled(size: QSize) -> bool:
+        return size.width() * size.height() > system.TILED_IMAGE_PIXELS
+
+
+    @staticmethod
+    def openBuffer(data: bytes) -> QBuffer:
+        buffer = QBuffer()
+        buffer.setData(data)
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        return buffer
+
+
+    @staticmethod
+    def readSize(data: bytes) -> QSize:
+        buffer = TiledGraphicsItem.openBuffer(data)
+        return QImageReader(buffer).size()
+
+
+    @staticmethod
+    def readPreview(data: bytes) -> QImage:
+        buffer = TiledGraphicsItem.openBuffer(data)
+        reader = QImageReader(buffer)
+        full_size = reader.size()
+        size = QSize(full_size)
+        size.scale(system.TILE_SIZE * 2, system.TILE_SIZE * 2, Qt.AspectRatioMode.KeepAspectRatio)
+        reader.setScaledSize(size)
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(f"cannot decode {full_size.width()}x{full_size.height()} image: {reader.errorString()}")
+        return image
+
+
+    def paintImage(self, painter: QPainter, option: QStyleOptionGraphicsItem, rect: QRectF) -> None:
+        # preview first, then whatever tiles of the matching level are decoded
+        super().paintImage(painter, option, rect)
+
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = 0
+        if scale > 0.0 and scale < 1.0:
+            level = min(int(math.log2(1.0 / scale)), self.levels - 1)
+        extent = system.TILE_SIZE * 2 ** level
+
+        exposed = option.exposedRect.intersected(rect)
+        if self.is_flipped:
+            exposed.moveLeft(rect.width() - exposed.right())
+
+        for ty in range(int(exposed.top() // extent), math.ceil(exposed.bottom() / extent)):
+            for tx in range(int(exposed.left() // extent), math.ceil(exposed.right() / extent)):
+                key = (level, tx, ty)
+                tile = self.tiles.get(key)
+                if tile is None:
+                    self.requestTile(key)
+                    continue
+                self.tiles.move_to_end(key)
+                target = QRectF(tx * extent, ty * extent, extent, extent).intersected(rect)
+                painter.drawPixmap(target, tile, QRectF(tile.rect()))
+
+
+    def requestTile(self, key: tuple) -> None:
+        if key in self.pending:
+            return
+
+        self.pending.add(key)
+        system.tile_loader.request(self, key)
+
+
+    def unloadPixmap(self) -> None:
+        # the preview stays, it cannot be decoded again without the whole image
+        self.tiles.clear()
+        self.update()
+
+
+    def setTile(self, key: tuple, image: QImage) -> None:
+        self.pending.discard(key)
+        self.tiles[key] = QPixmap.fromImage(image)
+        while len(self.tiles) > system.TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        self.update()
+
+
+class TileLoader(QObject):
+
+    loaded = pyqtSignal(object, object, QImage)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        self.pool = QThreadPool(self)
+        self.loaded.connect(self.onLoaded)
+        # tiles waiting to be decoded by image hash; the compressed data of
+        # those images, and the last full decode of an image that cannot be
+        # read in parts, are only kept while some of their tiles are pending
+        self.pending: dict[str, int] = {}
+        self.pending_lock = threading.Lock()
+        self.data: dict[str, bytes] = {}
+        self.source_key = None
+        self.source = QImage()
+        self.source_lock = threading.Lock()
+        QImageReader.setAllocationLimit(system.DECODE_ALLOCATION_LIMIT)
+
+
+    def request(self, item: TiledGraphicsItem, key: tuple) -> None:
+        with self.pending_lock:
+            self.pending[item.hash] = self.pending.get(item.hash, 0) + 1
+        self.pool.start(functools.partial(self.decode, item, item.hash, item.image_size.toSize(), key))
+
+
+    def decode(self, item: TiledGraphicsItem, digest: str, size: QSize, key: tuple) -> None:
+        # runs on the pool, only the pixels of one tile are decoded
+        level, tx, ty = key
+        scaled_size = QSize(math.ceil(size.width() / 2 ** level), math.ceil(size.height() / 2 ** level))
+        clip_rect = QRect(tx * system.TILE_SIZE, ty * system.TILE_SIZE, system.TILE_SIZE, system.TILE_SIZE)
+
+        try:
+            buffer = TiledGraphicsItem.openBuffer(self.getData(digest))
+            reader = QImageReader(buffer)
+            clip_rect = clip_rect.intersected(QRect(QPoint(), scaled_size))
+            if not reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+                image = self.decodeSource(reader, (digest, level), scaled_size).copy(clip_rect)
+            elif level > 0:
+                reader.setScaledSize(scaled_size)
+                reader.setScaledClipRect(clip_rect)
+                image = reader.read()
+            else:
+                reader.setClipRect(clip_rect)
+                image = reader.read()
+        finally:
+            self.release(digest)
+        self.loaded.emit(item, key, image)
+
+
+    def getData(self, digest: str) -> bytes:
+        with self.source_lock:
+            data = self.data.get(digest)
+            if data is None:
+                data = system.sql.getBlob(digest)
+                self.data[digest] = data
+            return data
+
+
+    def release(self, digest: str) -> None:
+        with self.pending_lock:
+            self.pending[digest] -= 1
+            if self.pending[digest] > 0:
+                return
+            del self.pending[digest]
+
+        # tiles requested from now on read and decode the image again
+        with self.source_lock:
+            self.data.pop(digest, None)
+            if self.source_key is not None and self.source_key[0] == digest:
+                self.source_key = None
+                self.source = QImage()
+
+
+    def decodeSource(self, reader: QImageReader, source_key: tuple, scaled_size: QSize) -> QImage:
+        # formats like PNG decode the whole image for any part of it
+        with self.source_lock:
+            if self.source_key != source_key:
+                self.source = QImage()
+                if scaled_size != reader.size():
+                    reader.setScaledSize(scaled_size)
+                self.source = reader.read()
+                self.source_key = source_key
+                if self.source.isNull():
+                    print(f"cannot decode tiles: {reader.errorString()}")
+            return self.source
+
+
+    def clear(self) -> None:
+        self.pool.waitForDone()
+        self.pending.clear()
+        self.data.clear()
+        self.source_key = None
+        self.source = QImage()
+
+
+    def onLoaded(self, item: TiledGraphicsItem, key: tuple, image: QImage) -> None:
+        if sip.isdeleted(item):
+            return
+        item.setTile(key, image)
@@ -0,0 +1,68 @@
+# Copyright (C) 2020-2022 viraelin
+# License: GPLv3.0
+
+import threading
+
+import system
+from graphics_item import GraphicsItem
+
+
+class ZOrder:
+
+    def __init__(self) -> None:
+        # every item is at or below top, raised items go above it
+        self.top = 0.0
+        self.renormalizations = 0
+        # the drop worker reserves values for the items it stores
+        self.lock = threading.Lock()
+
+
+    def reset(self) -> None:
+        with self.lock:
+            self.top = 0.0
+
+
+    def track(self, z_value: float) -> None:
+        with self.lock:
+            self.top = max(self.top, z_value)
+
+
+    def reserve(self, count: int = 1) -> float:
+        # first of count values above every item
+        with self.lock:
+            z_value = self.top + 1
+            self.top += count
+            return z_value
+
+
+    def raiseItems(self, items: list[GraphicsItem]) -> None:
+        if not items:
+            return
+
+        # already the topmost items, nothing to do
+        items = sorted(items, key=lambda item: item.zValue())
+        if items[0].zValue() > self.top - len(items):
+            return
+
+        if self.top + len(items) > system.Z_ORDER_LIMIT:
+            self.renormalize()
+
+        # relative order within the raised items is kept
+        z_value = self.reserve(len(items))
+        for item in items:
+            item.setZValue(z_value)
+            z_value += 1
+
+
+    def renormalize(self) -> None:
+        # values from a running drop would end up below the new top
+        if system.item_drop_thread.isRunning():
+            return
+
+        items = sorted(system.item_registry.items.values(), key=lambda item: item.zValue())
+        for z_value, item in enumerate(items):
+            if item.zValue() != z_value:
+                item.setZValue(z_value)
+        with self.lock:
+            self.top = float(len(items))
+        self.renormalizations += 1